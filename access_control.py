@@ -1,62 +1,176 @@
-from sqlalchemy import distinct
-from sqlalchemy.sql import text as sql_text, exists
+import os
+import threading
+import time
+from collections import OrderedDict
 
-from qwc_services_core.config_models import ConfigModels
-from qwc_services_core.runtime_config import RuntimeConfig
-from qwc_services_core.database import DatabaseEngine
 from qwc_services_core.auth import get_username, get_groups
 
+from metrics import ACCESS_CONTROL_CACHE_HITS, ACCESS_CONTROL_QUERY_DURATION
+
 
 class AccessControl:
 
-    def __init__(self, tenant, logger):
+    def __init__(self, tenant, logger, config):
         """Constructor
 
         :param str tenant: Tenant ID
         :param Logger logger: Application logger
+        :param RuntimeConfig config: Tenant config
         """
         self.tenant = tenant
         self.logger = logger
-
-        self.config_handler = RuntimeConfig("projectPublisher", logger)
-        self.config = self.config_handler.tenant_config(tenant)
+        self.config = config
+
+        # shared DB engine and config models, created on first DB query
+        self.db_engine = None
+        self.config_models = None
+        self.config_models_lock = threading.Lock()
+
+        # cache of publisher role decisions
+        # cache[(tenant, username, groups)] = (expires, is_publisher)
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_size = int(self.config.get('publisher_cache_size', 1000))
+        self.cache_ttl = float(self.config.get('publisher_cache_ttl', 300))
+
+        # touching this file invalidates the caches of all worker processes
+        self.invalidate_file = self.config.get('publisher_cache_invalidate_file')
+        if not self.invalidate_file and self.config.get('qgis_projects_scan_base_dir'):
+            self.invalidate_file = os.path.join(
+                self.config.get('qgis_projects_scan_base_dir'),
+                '.qwc_publisher_cache_invalidate')
+        self.invalidate_check_interval = float(
+            self.config.get('publisher_cache_invalidate_check_interval', 1))
+        self.invalidate_checked = 0
+        self.invalidate_mtime = self.read_invalidate_mtime()
+
+    def get_config_models(self):
+        """Return ConfigModels for tenant config DB, created only once."""
+        if self.config_models is None:
+            with self.config_models_lock:
+                if self.config_models is None:
+                    # import SQLAlchemy and config models on first use only
+                    from qwc_services_core.config_models import ConfigModels
+                    from qwc_services_core.database import DatabaseEngine
+
+                    self.db_engine = DatabaseEngine()
+                    conn_str = self.config.get('config_db_url', 'postgresql:///?service=qwc_configdb')
+                    self.config_models = ConfigModels(self.db_engine, conn_str)
+        return self.config_models
 
     def is_publisher(self, identity):
         """Check if user is in publishers group
 
         :param str identity: User identity
         """
-        db_engine = DatabaseEngine()
-        conn_str = self.config.get('config_db_url', 'postgresql:///?service=qwc_configdb')
-        self.config_models = ConfigModels(db_engine, conn_str)
+        username = get_username(identity)
+        groups = self.flat_groups(get_groups(identity))
+
+        cache_key = (self.tenant, username, tuple(sorted(str(group) for group in groups)))
+        publisher_role = self.cache_lookup(cache_key)
+        if publisher_role is not None:
+            self.logger.debug("Publisher role of %s read from cache" % username)
+            ACCESS_CONTROL_CACHE_HITS.inc(tenant=self.tenant)
+            return publisher_role
 
         publisher_role_name = self.config.get('publisher_role_name', 'publishers')
         self.logger.debug("publisher_role_name : %s" % publisher_role_name)
 
-        username = get_username(identity)
-        groups = get_groups(identity)
+        config_models = self.get_config_models()
+        session = config_models.session()
+        try:
+            with ACCESS_CONTROL_QUERY_DURATION.time(tenant=self.tenant):
+                publisher_role = self.publisher_role_query(username, groups, session, publisher_role_name)
+        finally:
+            session.close()
 
-        session = self.config_models.session()
-        publisher_role = self.publisher_role_query(username, groups, session, publisher_role_name)
-        session.close()
+        self.cache_store(cache_key, publisher_role)
 
         return publisher_role
 
-    def publisher_role_query(self, username, groups, session, publisher_role_name):
-        """Create base query for all permissions of a user and group.
-        Combine permissions from roles of user and user groups, groups roles and
-        public role.
+    def cache_lookup(self, key):
+        """Return cached publisher role decision or None if missing or expired
 
-        :param str username: User name
-        :param list or str groups: Groups names
-        :param Session session: DB session
-        :param str publisher_role_name: Publishers role name
+        :param tuple key: Cache key (tenant, username, groups)
+        """
+        self.check_invalidate_file()
+        with self.cache_lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            expires, publisher_role = entry
+            if expires < time.monotonic():
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return publisher_role
+
+    def cache_store(self, key, publisher_role):
+        """Store publisher role decision, evicting least recently used entries
+
+        :param tuple key: Cache key (tenant, username, groups)
+        :param bool publisher_role: Publisher role decision
         """
-        Role = self.config_models.model('roles')
-        Group = self.config_models.model('groups')
-        User = self.config_models.model('users')
+        if self.cache_size <= 0 or self.cache_ttl <= 0:
+            return
+        with self.cache_lock:
+            self.cache[key] = (time.monotonic() + self.cache_ttl, publisher_role)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def invalidate_cache(self, username=None):
+        """Remove cached publisher role decisions, of all worker processes
+        if username is not set
+
+        :param str username: Only remove decisions of this user if set
+        """
+        if username is None and self.invalidate_file:
+            try:
+                os.makedirs(os.path.dirname(self.invalidate_file), exist_ok=True)
+                with open(self.invalidate_file, 'a'):
+                    pass
+                os.utime(self.invalidate_file)
+            except OSError as e:
+                self.logger.warning(
+                    "Could not touch publisher cache invalidate file: %s" % str(e))
+        with self.cache_lock:
+            if username is None:
+                self.cache.clear()
+            else:
+                for key in [key for key in self.cache if key[1] == username]:
+                    del self.cache[key]
+
+    def read_invalidate_mtime(self):
+        """Return modification time of invalidate file, or None"""
+        if not self.invalidate_file:
+            return None
+        try:
+            return os.stat(self.invalidate_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def check_invalidate_file(self):
+        """Clear cache if invalidate file was touched since last check,
+        checked at most every invalidate_check_interval seconds"""
+        if not self.invalidate_file:
+            return
+        now = time.monotonic()
+        if now - self.invalidate_checked < self.invalidate_check_interval:
+            return
+        self.invalidate_checked = now
+        mtime = self.read_invalidate_mtime()
+        if mtime != self.invalidate_mtime:
+            self.invalidate_mtime = mtime
+            with self.cache_lock:
+                self.cache.clear()
+            self.logger.debug("Publisher role cache invalidated")
+
+    def flat_groups(self, groups):
+        """Return flat list of groups names
 
-        # check groups list
+        :param list or str groups: Groups names
+        """
         flat_groups_list = []
         if isinstance(groups, list):
             for item in groups:
@@ -68,6 +182,26 @@ class AccessControl:
         else:
             flat_groups_list.append(groups)
 
+        return flat_groups_list
+
+    def publisher_role_query(self, username, groups, session, publisher_role_name):
+        """Create base query for all permissions of a user and group.
+        Combine permissions from roles of user and user groups, groups roles and
+        public role.
+
+        :param str username: User name
+        :param list or str groups: Groups names
+        :param Session session: DB session
+        :param str publisher_role_name: Publishers role name
+        """
+        config_models = self.get_config_models()
+        Role = config_models.model('roles')
+        Group = config_models.model('groups')
+        User = config_models.model('users')
+
+        # check groups list
+        flat_groups_list = self.flat_groups(groups)
+
         # create query
         query = session.query(Role)
 
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from server import app
+
+
+class WsgiToAsgi:
+    """ASGI adapter for the WSGI application.
+
+    Request bodies are received asynchronously, so slow uploads do not hold a
+    worker thread. The WSGI application, which does file I/O and the config DB
+    access check, runs in a thread pool only once the request body is complete,
+    and responses are streamed chunk by chunk from the pool, each by a single
+    thread which stops when the client disconnects.
+    Routes, JSON responses and authentication are those of the WSGI mode.
+    """
+
+    def __init__(self, wsgi_app, threads=32, spool_size=1024 * 1024):
+        """Constructor
+        :param func wsgi_app: WSGI application
+        :param int threads: Max number of threads running the WSGI application
+        :param int spool_size: Request bodies larger than this are spooled to disk
+        """
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+        self.spool_size = spool_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+
+        body = SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                chunk = message.get('body', b'')
+                if chunk:
+                    await loop.run_in_executor(self.executor, body.write, chunk)
+                more_body = message.get('more_body', False)
+            content_length = body.tell()
+            body.seek(0)
+
+            environ = self.environ(scope, body, content_length)
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response['status'] = int(status.split(' ', 1)[0])
+                response['headers'] = [
+                    (name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in headers
+                ]
+
+            # chunks of the response, produced in a pool thread
+            chunks = asyncio.Queue(maxsize=4)
+            disconnected = threading.Event()
+
+            def put(item):
+                asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+            def run_app():
+                # the application, the iteration of its response and closing
+                # it run in the same thread, as context locals of streamed
+                # responses are bound to the thread
+                try:
+                    result = self.wsgi_app(environ, start_response)
+                    try:
+                        for chunk in result:
+                            if disconnected.is_set():
+                                break
+                            put(chunk)
+                    finally:
+                        if hasattr(result, 'close'):
+                            result.close()
+                    put(None)
+                except BaseException as e:
+                    put(e)
+
+            running = loop.run_in_executor(self.executor, run_app)
+            # stop streaming responses, e.g. change events, if client disconnects
+            disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+            disconnect.add_done_callback(lambda future: disconnected.set())
+            try:
+                started = False
+                while True:
+                    item = await chunks.get()
+                    if isinstance(item, BaseException):
+                        raise item
+                    if disconnected.is_set():
+                        break
+                    if not started:
+                        await send({
+                            'type': 'http.response.start',
+                            'status': response['status'],
+                            'headers': response['headers']
+                        })
+                        started = True
+                    if item is None:
+                        await send({'type': 'http.response.body', 'body': b''})
+                        break
+                    if item:
+                        await send({
+                            'type': 'http.response.body',
+                            'body': item,
+                            'more_body': True
+                        })
+            finally:
+                disconnect.cancel()
+                disconnected.set()
+                # discard chunks until the producer thread has finished
+                while not running.done():
+                    getter = asyncio.ensure_future(chunks.get())
+                    await asyncio.wait([getter, running], return_when=asyncio.FIRST_COMPLETED)
+                    getter.cancel()
+        finally:
+            body.close()
+
+    async def wait_disconnect(self, receive):
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    def environ(self, scope, body, content_length):
+        """Build WSGI environ from ASGI HTTP scope"""
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'CONTENT_LENGTH': str(content_length),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_LENGTH':
+                continue
+            if name != 'CONTENT_TYPE':
+                name = 'HTTP_%s' % name
+            if name in environ:
+                value = '%s,%s' % (environ[name], value)
+            environ[name] = value
+        return environ
+
+
+application = WsgiToAsgi(
+    app,
+    threads=int(os.environ.get('ASGI_THREADS', 32)),
+    spool_size=int(os.environ.get('ASGI_SPOOL_SIZE', 1024 * 1024)))
@@ -0,0 +1,237 @@
+"""Benchmark fixtures: synthetic scan trees, config generator stub and
+SQLite config DB."""
+import os
+import random
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PROJECT_TEMPLATE = """<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>
+<qgis projectname="%(name)s" version="3.22.4-Białowieża">
+  <title>%(name)s</title>
+  <projectCrs>
+    <spatialrefsys>
+      <authid>EPSG:2056</authid>
+    </spatialrefsys>
+  </projectCrs>
+  <projectlayers>
+%(layers)s
+  </projectlayers>
+</qgis>
+"""
+
+LAYER_TEMPLATE = """    <maplayer type="vector" geometry="Polygon">
+      <id>layer_%(index)d</id>
+      <datasource>service='qwc_geodb' key='id' table="public"."layer_%(index)d" (geom)</datasource>
+      <layername>Layer %(index)d</layername>
+      <provider encoding="UTF-8">postgres</provider>
+    </maplayer>"""
+
+
+def parse_size(value):
+    """Parse size with optional k or m suffix, e.g. '50k'
+    :param str value: Size
+    """
+    value = value.strip().lower()
+    factor = 1
+    if value.endswith('k'):
+        factor, value = 1024, value[:-1]
+    elif value.endswith('m'):
+        factor, value = 1024 * 1024, value[:-1]
+    return int(float(value) * factor)
+
+
+def project_content(name, size):
+    """Return synthetic QGIS project of about size bytes
+    :param str name: Project name
+    :param int size: Approximate size in bytes
+    """
+    layer_size = len(LAYER_TEMPLATE % {'index': 0})
+    count = max(1, (size - len(PROJECT_TEMPLATE)) // layer_size)
+    layers = '\n'.join(LAYER_TEMPLATE % {'index': i} for i in range(count))
+    return (PROJECT_TEMPLATE % {'name': name, 'layers': layers}).encode('utf-8')
+
+
+def create_scan_tree(base_dir, projects, sizes, depth=2, fanout=10, seed=0):
+    """Write synthetic projects in nested dirs, return their relative paths
+    :param str base_dir: Scan base dir
+    :param int projects: Number of projects
+    :param list(int) sizes: Project sizes, picked at random
+    :param int depth: Number of nested dir levels
+    :param int fanout: Number of subdirs per dir
+    :param int seed: Random seed
+    """
+    rand = random.Random(seed)
+    templates = {}
+    relpaths = []
+    for i in range(projects):
+        dirs = [
+            'dir_%d' % rand.randrange(fanout)
+            for level in range(rand.randint(0, depth))
+        ]
+        relpath = os.path.join(*(dirs + ['project_%d.qgs' % i]))
+        size = rand.choice(sizes)
+        if size not in templates:
+            templates[size] = project_content('PROJECT_NAME', size)
+        path = os.path.join(base_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(templates[size].replace(
+                b'PROJECT_NAME', ('project_%d' % i).encode()))
+        relpaths.append(relpath)
+    return relpaths
+
+
+class ConfigGeneratorStub:
+    """Local stand-in for QWC Config Service /generate_configs"""
+
+    def __init__(self, delay=0.0):
+        """Constructor
+        :param float delay: Seconds per config generation
+        """
+        self.delay = delay
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                with stub.lock:
+                    stub.requests += 1
+                time.sleep(stub.delay)
+                body = b'INFO: Finished writing service configs\n'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+CONFIG_DB_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, description TEXT,
+    email TEXT, password_hash TEXT, failed_sign_in_count INTEGER,
+    totp_secret TEXT, last_sign_in_at TIMESTAMP
+);
+CREATE TABLE user_infos (
+    id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users(id)
+);
+CREATE TABLE groups (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, description TEXT
+);
+CREATE TABLE roles (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, description TEXT
+);
+CREATE TABLE groups_users (
+    group_id INTEGER NOT NULL REFERENCES groups(id),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    PRIMARY KEY (group_id, user_id)
+);
+CREATE TABLE users_roles (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    role_id INTEGER NOT NULL REFERENCES roles(id),
+    PRIMARY KEY (user_id, role_id)
+);
+CREATE TABLE groups_roles (
+    group_id INTEGER NOT NULL REFERENCES groups(id),
+    role_id INTEGER NOT NULL REFERENCES roles(id),
+    PRIMARY KEY (group_id, role_id)
+);
+CREATE TABLE resource_types (
+    name TEXT PRIMARY KEY, description TEXT, list_order INTEGER
+);
+CREATE TABLE resources (
+    id INTEGER PRIMARY KEY, parent_id INTEGER REFERENCES resources(id),
+    type TEXT REFERENCES resource_types(name), name TEXT NOT NULL
+);
+CREATE TABLE permissions (
+    id INTEGER PRIMARY KEY, role_id INTEGER REFERENCES roles(id),
+    resource_id INTEGER REFERENCES resources(id), priority INTEGER,
+    write BOOLEAN
+);
+CREATE TABLE registrable_groups (
+    id INTEGER PRIMARY KEY, group_id INTEGER REFERENCES groups(id),
+    title TEXT, description TEXT
+);
+CREATE TABLE registration_requests (
+    id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users(id),
+    registrable_group_id INTEGER REFERENCES registrable_groups(id),
+    unsubscribe BOOLEAN, pending BOOLEAN, accepted BOOLEAN,
+    admin_comment TEXT, created_at TIMESTAMP, updated_at TIMESTAMP
+);
+CREATE TABLE last_update (
+    updated_at TIMESTAMP PRIMARY KEY
+);
+"""
+
+
+def create_config_db(path, users=1000, groups=100, publisher_role_name='publishers', seed=0):
+    """Create SQLite config DB with the QWC config tables used by
+    AccessControl, with users user_1 to user_<users>.
+    Half of the groups have the publishers role.
+    :param str path: SQLite file path
+    :param int users: Number of users
+    :param int groups: Number of groups
+    :param str publisher_role_name: Publishers role name
+    :param int seed: Random seed
+    """
+    rand = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(CONFIG_DB_SCHEMA)
+        conn.execute("INSERT INTO roles (id, name) VALUES (1, ?)", (publisher_role_name,))
+        conn.executemany(
+            "INSERT INTO groups (id, name) VALUES (?, ?)",
+            [(i, 'group_%d' % i) for i in range(1, groups + 1)])
+        conn.executemany(
+            "INSERT INTO groups_roles (group_id, role_id) VALUES (?, 1)",
+            [(i,) for i in range(1, groups + 1, 2)])
+        conn.executemany(
+            "INSERT INTO users (id, name) VALUES (?, ?)",
+            [(i, 'user_%d' % i) for i in range(1, users + 1)])
+        for i in range(1, users + 1):
+            user_groups = rand.sample(range(1, groups + 1), min(3, groups))
+            conn.executemany(
+                "INSERT INTO groups_users (group_id, user_id) VALUES (?, ?)",
+                [(group, i) for group in user_groups])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def sqlite_config_models(path):
+    """Return ConfigModels for a SQLite config DB, attached as schema
+    qwc_config as in the PostgreSQL config DB
+    :param str path: SQLite file path
+    """
+    from sqlalchemy import event
+    from qwc_services_core.config_models import ConfigModels
+    from qwc_services_core.database import DatabaseEngine
+
+    db_engine = DatabaseEngine()
+    conn_str = 'sqlite://'
+    engine = db_engine.db_engine(conn_str)
+
+    @event.listens_for(engine, 'connect')
+    def attach(dbapi_conn, record):
+        dbapi_conn.execute("ATTACH DATABASE ? AS qwc_config", (path,))
+
+    return db_engine, ConfigModels(db_engine, conn_str)
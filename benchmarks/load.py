@@ -0,0 +1,419 @@
+"""Load benchmark: throughput and latency of publisher hot paths.
+
+Generates a synthetic scan tree, starts a local config generator stub and
+the service in a separate process, then sends requests from concurrent
+clients to each endpoint. Publishing with sync=true includes the config
+generation, and before the service is stopped the benchmark waits for the
+pending config generation, so that all debounced updates reach the stub.
+AccessControl.is_publisher is measured in-process against a SQLite config
+DB, or the config DB given by --config-db-url, with checks spread over
+--active-users users, with and without the publisher cache.
+
+    python benchmarks/load.py --projects 10000 --clients 8 --output results.json
+    python benchmarks/load.py --projects 10000 --compare results.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fixtures import (
+    ConfigGeneratorStub, create_config_db, create_scan_tree, parse_size,
+    project_content, sqlite_config_models
+)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+SERVER_SCRIPT = """
+import sys
+sys.path.insert(0, %(root)r)
+from werkzeug.serving import make_server
+from server import app
+server = make_server('127.0.0.1', 0, app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+
+ENDPOINTS = [
+    'listprojects', 'listprojects_page', 'getproject', 'getproject_gzip',
+    'getproject_conditional', 'publish', 'publish_unchanged', 'publish_sync'
+]
+
+# endpoints waiting for config generation, measured with --sync-requests
+SYNC_ENDPOINTS = ['publish_sync']
+
+
+class Endpoints:
+    """Request builders, each call sends one request with a session"""
+
+    def __init__(self, url, relpaths, seed=0):
+        """Constructor
+        :param str url: Service base URL
+        :param list(str) relpaths: Projects of the scan tree
+        :param int seed: Random seed
+        """
+        self.url = url.rstrip('/')
+        self.relpaths = relpaths
+        self.rand = random.Random(seed)
+        self.etags = {}
+
+    def project(self):
+        return self.rand.choice(self.relpaths)
+
+    def listprojects(self, session):
+        return session.get(self.url + '/listprojects')
+
+    def listprojects_page(self, session):
+        offset = self.rand.randrange(max(1, len(self.relpaths) - 100))
+        return session.get(self.url + '/listprojects', params={
+            'offset': offset, 'limit': 100})
+
+    def getproject(self, session):
+        return session.get(self.url + '/getproject', params={
+            'filename': self.project()}, headers={'Accept-Encoding': 'identity'})
+
+    def getproject_gzip(self, session):
+        return session.get(self.url + '/getproject', params={
+            'filename': self.project()}, headers={'Accept-Encoding': 'gzip'})
+
+    def getproject_conditional(self, session):
+        filename = self.project()
+        headers = {'Accept-Encoding': 'identity'}
+        if filename in self.etags:
+            headers['If-None-Match'] = self.etags[filename]
+        response = session.get(self.url + '/getproject', params={
+            'filename': filename}, headers=headers)
+        if 'ETag' in response.headers:
+            self.etags[filename] = response.headers['ETag']
+        return response
+
+    def publish(self, session):
+        filename = 'bench/publish_%d.qgs' % self.rand.randrange(100)
+        content = project_content('publish %f' % self.rand.random(), 50 * 1024)
+        return session.post(self.url + '/publish', files={
+            'file': (filename, content)})
+
+    def publish_unchanged(self, session):
+        filename = 'bench/unchanged.qgs'
+        content = project_content('unchanged', 50 * 1024)
+        return session.post(self.url + '/publish', files={
+            'file': (filename, content)})
+
+    def publish_sync(self, session):
+        filename = 'bench/publish_sync_%d.qgs' % self.rand.randrange(100)
+        content = project_content('publish sync %f' % self.rand.random(), 50 * 1024)
+        return session.post(self.url + '/publish', params={'sync': 'true'}, files={
+            'file': (filename, content)})
+
+
+def percentile(values, percent):
+    """Return percentile of sorted values, nearest rank"""
+    if not values:
+        return None
+    index = max(0, int(round(percent / 100.0 * len(values))) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput': count / elapsed if elapsed > 0 else None,
+        'mean': statistics.mean(latencies) if latencies else None,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else None
+    }
+
+
+def run_endpoint(endpoints, name, clients, requests_count, warmup):
+    """Send requests_count requests to an endpoint from concurrent clients
+    :param Endpoints endpoints: Request builders
+    :param str name: Endpoint name
+    :param int clients: Number of concurrent clients
+    :param int requests_count: Number of measured requests
+    :param int warmup: Number of unmeasured requests per client
+    """
+    request = getattr(endpoints, name)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [requests_count]
+
+    def client():
+        with requests.Session() as session:
+            for i in range(warmup):
+                request(session)
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                start = time.perf_counter()
+                try:
+                    response = request(session)
+                    failed = response.status_code >= 400 or (
+                        response.headers.get('Content-Type') == 'application/json' and
+                        'error' in response.json())
+                except requests.RequestException:
+                    failed = True
+                duration = time.perf_counter() - start
+                with lock:
+                    latencies.append(duration)
+                    if failed:
+                        errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        for future in [executor.submit(client) for i in range(clients)]:
+            future.result()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def wait_config_update(url, timeout):
+    """Wait until latest service configurations update has finished, return
+    its status and the waiting time
+    :param str url: Service base URL
+    :param float timeout: Max seconds to wait
+    """
+    start = time.perf_counter()
+    status = None
+    while time.perf_counter() - start < timeout:
+        response = requests.get(url + '/configstatus')
+        if response.status_code == 404:
+            # no update requested
+            break
+        status = response.json().get('status')
+        if status in ['succeeded', 'failed']:
+            break
+        time.sleep(0.1)
+    return status, time.perf_counter() - start
+
+
+def run_access_control(config_db_url, db_path, users, active_users, groups, clients,
+                       requests_count, cache_ttl):
+    """Measure AccessControl.is_publisher from concurrent threads
+    :param str config_db_url: Config DB URL, SQLite config DB at db_path if None
+    :param str db_path: SQLite config DB path
+    :param int users: Number of users in SQLite config DB
+    :param int active_users: Number of users checked, picked at random
+    :param int groups: Number of groups in SQLite config DB
+    :param int clients: Number of concurrent threads
+    :param int requests_count: Number of measured checks
+    :param float cache_ttl: publisher_cache_ttl, 0 to query the config DB on every check
+    """
+    import logging
+    sys.path.insert(0, ROOT_DIR)
+    from access_control import AccessControl
+
+    config = {
+        'publisher_cache_ttl': cache_ttl,
+        'publisher_cache_size': users
+    }
+    if config_db_url:
+        config['config_db_url'] = config_db_url
+    access_control = AccessControl('default', logging.getLogger('benchmark'), config)
+    if not config_db_url:
+        if not os.path.exists(db_path):
+            create_config_db(db_path, users, groups)
+        access_control.db_engine, access_control.config_models = sqlite_config_models(db_path)
+    rand = random.Random(0)
+    identities = [
+        {'username': 'user_%d' % i, 'groups': []}
+        for i in rand.sample(range(1, users + 1), min(active_users, users))
+    ]
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [requests_count]
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                identity = dict(rand.choice(identities))
+            start = time.perf_counter()
+            try:
+                access_control.is_publisher(identity)
+                failed = False
+            except Exception:
+                failed = True
+            duration = time.perf_counter() - start
+            with lock:
+                latencies.append(duration)
+                if failed:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        for future in [executor.submit(client) for i in range(clients)]:
+            future.result()
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def start_server(config_path):
+    """Start service in a new process, return (process, URL)
+    :param str config_path: CONFIG_PATH of service
+    """
+    env = dict(os.environ, CONFIG_PATH=config_path, AUTH_REQUIRED='False')
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER_SCRIPT % {'root': ROOT_DIR}],
+        cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    port = int(process.stdout.readline())
+    return process, 'http://127.0.0.1:%d' % port
+
+
+def compare(results, baseline):
+    """Print changes relative to baseline results"""
+    print('%-24s %12s %12s %12s' % ('endpoint', 'throughput', 'p50', 'p99'))
+    for name, result in results['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        changes = []
+        for key in ['throughput', 'p50', 'p99']:
+            if result.get(key) and base.get(key):
+                changes.append('%+.1f%%' % (100.0 * (result[key] - base[key]) / base[key]))
+            else:
+                changes.append('-')
+        print('%-24s %12s %12s %12s' % tuple([name] + changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--projects', type=int, default=1000, help='Number of projects in scan tree')
+    parser.add_argument('--sizes', default='2k,50k,500k', help='Comma separated project sizes')
+    parser.add_argument('--depth', type=int, default=3, help='Max dir nesting of projects')
+    parser.add_argument('--fanout', type=int, default=10, help='Number of subdirs per dir')
+    parser.add_argument('--clients', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=500, help='Number of requests per endpoint')
+    parser.add_argument('--sync-requests', type=int, default=20,
+                        help='Number of requests of endpoints waiting for config generation')
+    parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per client')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS + ['access_control']),
+                        help='Comma separated endpoints to measure')
+    parser.add_argument('--generator-delay', type=float, default=0.5,
+                        help='Seconds per config generation of the config generator stub')
+    parser.add_argument('--config-db-url', help='Config DB URL instead of SQLite config DB')
+    parser.add_argument('--users', type=int, default=1000, help='Number of users in SQLite config DB')
+    parser.add_argument('--active-users', type=int, default=100,
+                        help='Number of users checked by access_control')
+    parser.add_argument('--access-control-requests', type=int, default=5000,
+                        help='Number of access_control checks')
+    parser.add_argument('--config-timeout', type=float, default=60,
+                        help='Max seconds to wait for pending config generation')
+    parser.add_argument('--groups', type=int, default=100, help='Number of groups in SQLite config DB')
+    parser.add_argument('--work-dir', help='Dir of scan tree and config, kept if set')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--output', help='Write JSON results to file')
+    parser.add_argument('--compare', help='Print changes relative to JSON results file')
+    args = parser.parse_args()
+
+    endpoint_names = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='qwc-publisher-bench-')
+    scan_dir = os.path.join(work_dir, 'scan')
+    config_path = os.path.join(work_dir, 'config')
+
+    generator = ConfigGeneratorStub(args.generator_delay).start()
+    process = None
+    try:
+        relpaths_path = os.path.join(work_dir, 'projects.json')
+        if os.path.exists(relpaths_path):
+            with open(relpaths_path) as fh:
+                relpaths = json.load(fh)
+        else:
+            start = time.perf_counter()
+            relpaths = create_scan_tree(
+                scan_dir, args.projects, [parse_size(size) for size in args.sizes.split(',')],
+                args.depth, args.fanout, args.seed)
+            print('Created %d projects in %.1fs' % (len(relpaths), time.perf_counter() - start),
+                  file=sys.stderr)
+            with open(relpaths_path, 'w') as fh:
+                json.dump(relpaths, fh)
+
+        os.makedirs(os.path.join(config_path, 'default'), exist_ok=True)
+        with open(os.path.join(config_path, 'default', 'projectPublisherConfig.json'), 'w') as fh:
+            json.dump({
+                'service': 'projectPublisher',
+                'config': {
+                    'qgis_projects_scan_base_dir': scan_dir,
+                    'config_generator_service_url': generator.url,
+                    'compression_cache_dir': os.path.join(work_dir, 'compressed')
+                }
+            }, fh)
+
+        results = {
+            'benchmark': 'load',
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'params': {
+                key: value for key, value in vars(args).items()
+                if key not in ['output', 'compare', 'work_dir']
+            },
+            'results': {}
+        }
+
+        http_endpoints = [name for name in endpoint_names if name in ENDPOINTS]
+        if http_endpoints:
+            process, url = start_server(config_path)
+            endpoints = Endpoints(url, relpaths, args.seed)
+            # first request loads tenant config and project index
+            start = time.perf_counter()
+            requests.get(url + '/listprojects')
+            results['first_listprojects'] = time.perf_counter() - start
+
+            for name in http_endpoints:
+                requests_count = args.sync_requests if name in SYNC_ENDPOINTS else args.requests
+                warmup = 0 if name in SYNC_ENDPOINTS else args.warmup
+                results['results'][name] = run_endpoint(
+                    endpoints, name, args.clients, requests_count, warmup)
+                print('%s: %s' % (name, json.dumps(results['results'][name])), file=sys.stderr)
+
+            # debounced config generations of publish requests
+            status, duration = wait_config_update(url, args.config_timeout)
+            results['config_update'] = {'status': status, 'wait': duration}
+
+        if 'access_control' in endpoint_names:
+            db_path = os.path.join(work_dir, 'configdb.sqlite')
+            for name, cache_ttl in [('access_control', 300), ('access_control_uncached', 0)]:
+                results['results'][name] = run_access_control(
+                    args.config_db_url, db_path, args.users, args.active_users, args.groups,
+                    args.clients, args.access_control_requests, cache_ttl)
+                print('%s: %s' % (name, json.dumps(results['results'][name])), file=sys.stderr)
+
+        results['config_generator_requests'] = generator.requests
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        generator.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(results, json.load(fh))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Startup benchmark: time to first response of a fresh service process.
+
+Each run starts a new Python process, which imports the WSGI application
+and sends a first request through the Flask test client.
+
+    CONFIG_PATH=../qwc-docker/volumes/config python benchmarks/startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+CHILD_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, %(root)r)
+from server import app
+imported = time.perf_counter()
+response = app.test_client().get(%(path)r)
+done = time.perf_counter()
+print('%%f %%f %%d' %% (imported - start, done - imported, response.status_code))
+"""
+
+
+def run_once(path):
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD_SCRIPT % {'root': ROOT_DIR, 'path': path}],
+        cwd=ROOT_DIR)
+    total = time.perf_counter() - start
+    import_time, first_request_time, status = output.decode().split()[-3:]
+    return {
+        'total': total,
+        'import': float(import_time),
+        'first_request': float(first_request_time),
+        'status': int(status)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='Number of process starts')
+    parser.add_argument('--path', default='/listprojects', help='Path of first request')
+    parser.add_argument('--output', help='Write JSON results to file')
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for i in range(args.runs)]
+    results = {
+        'benchmark': 'startup',
+        'path': args.path,
+        'runs': len(runs),
+        'statuses': sorted(set(run['status'] for run in runs))
+    }
+    for key in ['total', 'import', 'first_request']:
+        values = [run[key] for run in runs]
+        results[key] = {
+            'median': statistics.median(values),
+            'min': min(values),
+            'max': max(values)
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+
+class ChangeLog:
+    """ChangeLog class
+    Ordered log of project changes of a tenant, with sequence numbers.
+    Changes are appended to a JSON lines file shared by all worker processes,
+    and the latest changes are kept in an in-memory ring buffer, refreshed
+    from the file when other processes have appended to it.
+    """
+
+    def __init__(self, log_path, logger, buffer_size=1000, max_entries=100000,
+                 poll_interval=1):
+        """Constructor
+        :param str log_path: Path of log file
+        :param Logger logger: Application logger
+        :param int buffer_size: Number of changes kept in memory
+        :param int max_entries: Number of changes kept in log file
+        :param float poll_interval: Interval in seconds between checks for
+                                    changes of other processes while waiting
+        """
+        self.log_path = log_path
+        self.logger = logger
+        self.max_entries = max_entries
+        self.poll_interval = poll_interval
+
+        self.buffer = deque(maxlen=max(1, buffer_size))
+        self.last_seq = 0
+        # log file and position read so far
+        self.fh = None
+        self.offset = 0
+        self.condition = threading.Condition()
+
+    def append(self, event, path, sha256=None):
+        """Append a change, return it
+        :param str event: 'published', 'deleted' or 'cleaned'
+        :param str path: Project or dir path relative to scan dir
+        :param str sha256: SHA-256 of published project
+        """
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with self.condition:
+            with open(self.log_path + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    self.refresh()
+                    change = {
+                        'seq': self.last_seq + 1,
+                        'event': event,
+                        'path': path,
+                        'sha256': sha256,
+                        'time': time.time()
+                    }
+                    with open(self.log_path, 'a', encoding='utf-8') as fh:
+                        fh.write(json.dumps(change) + '\n')
+                    self.refresh()
+                    if self.last_seq - self.read_first_seq() >= 2 * self.max_entries:
+                        self.compact()
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            self.condition.notify_all()
+        return change
+
+    def since(self, seq, limit=1000):
+        """Return changes after a sequence number, and whether changes are
+        missing, because they are no longer in the log
+        :param int seq: Last sequence number seen by client, 0 for all changes
+        :param int limit: Max number of changes returned
+        """
+        with self.condition:
+            self.refresh()
+            if seq > self.last_seq:
+                # log was reset
+                return [], True
+            if self.buffer and seq >= self.buffer[0]['seq'] - 1:
+                changes = [c for c in self.buffer if c['seq'] > seq]
+                return changes[:limit], False
+            if seq == self.last_seq:
+                return [], False
+
+        # older changes are read from log file
+        changes = []
+        first_seq = None
+        for change in self.read_changes():
+            if first_seq is None:
+                first_seq = change['seq']
+            if change['seq'] > seq:
+                changes.append(change)
+                if len(changes) >= limit:
+                    break
+        if first_seq is None or first_seq > seq + 1:
+            # changes are missing, client must reload all projects
+            return [], True
+        return changes, False
+
+    def current_seq(self):
+        """Return sequence number of last change"""
+        with self.condition:
+            self.refresh()
+            return self.last_seq
+
+    def wait(self, seq, timeout, limit=1000):
+        """Wait up to timeout seconds for changes after a sequence number,
+        see since()
+        :param int seq: Last sequence number seen by client
+        :param float timeout: Max wait in seconds
+        :param int limit: Max number of changes returned
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            changes, truncated = self.since(seq, limit)
+            remaining = deadline - time.monotonic()
+            if changes or truncated or remaining <= 0:
+                return changes, truncated
+            with self.condition:
+                if self.last_seq <= seq:
+                    self.condition.wait(min(self.poll_interval, remaining))
+
+    def refresh(self):
+        """Read changes appended by other processes"""
+        try:
+            stat = os.stat(self.log_path)
+            if self.fh is None or os.fstat(self.fh.fileno()).st_ino != stat.st_ino:
+                # new or compacted log file, kept open so that its inode
+                # is not reused by a later compaction
+                if self.fh is not None:
+                    self.fh.close()
+                self.fh = open(self.log_path, 'rb')
+                self.offset = 0
+                self.buffer.clear()
+        except OSError:
+            return
+
+        self.fh.seek(self.offset)
+        for line in self.fh:
+            if not line.endswith(b'\n'):
+                # partial line being written
+                break
+            self.offset += len(line)
+            change = self.parse(line)
+            if change:
+                self.buffer.append(change)
+                self.last_seq = max(self.last_seq, change['seq'])
+
+    def read_changes(self):
+        """Yield changes of log file"""
+        try:
+            with open(self.log_path, 'rb') as fh:
+                for line in fh:
+                    if not line.endswith(b'\n'):
+                        break
+                    change = self.parse(line)
+                    if change:
+                        yield change
+        except OSError as e:
+            self.logger.debug("Error : %s" % str(e))
+
+    def parse(self, line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            self.logger.warning("Invalid line in change log '%s'" % self.log_path)
+            return None
+
+    def read_first_seq(self):
+        for change in self.read_changes():
+            return change['seq']
+        return self.last_seq
+
+    def compact(self):
+        """Keep last max_entries changes in log file"""
+        changes = deque(self.read_changes(), maxlen=self.max_entries)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.log_path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+                for change in changes:
+                    fh.write(json.dumps(change) + '\n')
+            os.replace(tmp_path, self.log_path)
+        except OSError as e:
+            self.logger.warning("Could not compact change log '%s'" % self.log_path)
+            self.logger.debug("Error : %s" % str(e))
+        self.refresh()
+
+    def close(self):
+        with self.condition:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
@@ -0,0 +1,199 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    # zstd support is optional
+    zstandard = None
+
+
+def available_encodings():
+    """Return supported content encodings, by order of preference"""
+    if zstandard is not None:
+        return ['zstd', 'gzip']
+    return ['gzip']
+
+
+def negotiate_encoding(accept_encodings):
+    """Return best supported encoding for Accept-Encoding header, or None
+    :param MIMEAccept accept_encodings: Parsed Accept-Encoding header
+    """
+    return accept_encodings.best_match(available_encodings())
+
+
+def decompress_stream(file, encoding, max_size=0):
+    """Return file-like object decompressing a stream while reading it,
+    or None if encoding is not supported
+    :param object file: Compressed file-like object
+    :param str encoding: Content encoding
+    :param int max_size: Max decompressed size in bytes, 0 for no limit
+    """
+    if not encoding or encoding == 'identity':
+        return file
+    if encoding in ['gzip', 'x-gzip']:
+        reader = gzip.GzipFile(fileobj=file, mode='rb')
+        if not is_seekable(file):
+            reader = StreamReader(reader)
+    elif encoding == 'zstd' and zstandard is not None:
+        # zstd reader can not seek backwards
+        reader = StreamReader(zstandard.ZstdDecompressor().stream_reader(file))
+    else:
+        return None
+    if max_size > 0:
+        return LimitedReader(reader, max_size)
+    return reader
+
+
+def is_seekable(file):
+    try:
+        return file.seekable()
+    except AttributeError:
+        return hasattr(file, 'seek')
+
+
+class StreamReader:
+    """Read-only view of a file-like object, hiding its seek method"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+
+class SizeLimitError(ValueError):
+    """Data read from a LimitedReader exceeds its max size"""
+
+
+class LimitedReader:
+    """File-like object raising SizeLimitError when more than max_size bytes
+    are read, e.g. from a small compressed request body"""
+
+    def __init__(self, file, max_size):
+        self.file = file
+        self.max_size = max_size
+        self.position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            # never read more than the limit at once
+            size = self.max_size - self.position + 1
+        chunk = self.file.read(size)
+        self.position += len(chunk)
+        if self.position > self.max_size:
+            raise SizeLimitError("Data exceeds max size of %d bytes" % self.max_size)
+        return chunk
+
+    def seek(self, offset, whence=0):
+        # AttributeError if file is not seekable
+        self.position = self.file.seek(offset, whence)
+        return self.position
+
+
+class CompressionCache:
+    """CompressionCache class
+    Compressed variants of project files on disk, keyed by file path, size
+    and mtime, so that files are only compressed once per change.
+    Variants of a file are stored in a dir per file path, and compressed
+    while holding a lock of this file only.
+    """
+
+    EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+
+    def __init__(self, cache_dir, logger, chunk_size=1024 * 1024):
+        """Constructor
+        :param str cache_dir: Dir of compressed files
+        :param Logger logger: Application logger
+        :param int chunk_size: Read size for compressing files
+        """
+        self.cache_dir = cache_dir
+        self.logger = logger
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        # key_locks[key] = [lock, number of users]
+        self.key_locks = {}
+
+    def get(self, path, encoding):
+        """Return path of compressed file, or None on error
+        :param str path: Source file path
+        :param str encoding: Content encoding (gzip or zstd)
+        """
+        try:
+            stat = os.stat(path)
+            key_dir = self.key_dir(path)
+            compressed_path = os.path.join(key_dir, "%d-%d.%s" % (
+                stat.st_mtime_ns, stat.st_size, self.EXTENSIONS[encoding]))
+            if os.path.exists(compressed_path):
+                return compressed_path
+
+            with self.key_lock(key_dir):
+                if os.path.exists(compressed_path):
+                    # compressed while waiting for lock
+                    return compressed_path
+                os.makedirs(key_dir, exist_ok=True)
+                self.remove_variants(key_dir, encoding)
+                self.compress(path, compressed_path, encoding)
+                # use source mtime for Last-Modified of compressed variant
+                os.utime(compressed_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            return compressed_path
+        except Exception as e:
+            self.logger.warning("Unable to compress file %s" % path)
+            self.logger.debug("Error : %s" % str(e))
+            return None
+
+    def remove(self, path):
+        """Remove compressed variants of a deleted file
+        :param str path: Source file path
+        """
+        key_dir = self.key_dir(path)
+        with self.key_lock(key_dir):
+            shutil.rmtree(key_dir, ignore_errors=True)
+
+    def key_dir(self, path):
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    @contextmanager
+    def key_lock(self, key):
+        with self.lock:
+            entry = self.key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.key_locks[key]
+
+    def compress(self, path, compressed_path, encoding):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(compressed_path), suffix='.tmp')
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                if encoding == 'zstd':
+                    with zstandard.ZstdCompressor().stream_writer(dst, closefd=False) as writer:
+                        shutil.copyfileobj(src, writer, self.chunk_size)
+                else:
+                    with gzip.GzipFile(fileobj=dst, mode='wb', mtime=0) as writer:
+                        shutil.copyfileobj(src, writer, self.chunk_size)
+            os.replace(tmp_path, compressed_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def remove_variants(self, key_dir, encoding):
+        """Remove outdated compressed variants of a file"""
+        suffix = '.%s' % self.EXTENSIONS[encoding]
+        for filename in os.listdir(key_dir):
+            if filename.endswith(suffix):
+                try:
+                    os.remove(os.path.join(key_dir, filename))
+                except OSError:
+                    pass
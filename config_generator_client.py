@@ -0,0 +1,133 @@
+import threading
+import time
+import urllib
+
+
+class CircuitOpenError(Exception):
+    """Raised while the circuit breaker rejects requests"""
+    pass
+
+
+class ConfigGeneratorClient:
+    """ConfigGeneratorClient class
+    HTTP client for QWC Config Service, with pooled keep-alive connections,
+    timeouts, retries with exponential backoff on transient errors, and a
+    circuit breaker opened after repeated failures.
+    """
+
+    CRITICAL_MARKER = b'CRITICAL'
+
+    def __init__(self, base_url, logger, connect_timeout=5, read_timeout=300,
+                 retries=3, backoff_factor=0.5, failure_threshold=5,
+                 reset_timeout=60, chunk_size=64 * 1024):
+        """Constructor
+        :param str base_url: QWC Config Service URL
+        :param Logger logger: Application logger
+        :param float connect_timeout: Connect timeout in seconds
+        :param float read_timeout: Read timeout in seconds
+        :param int retries: Max retries on connection errors and 503
+        :param float backoff_factor: Retry backoff factor in seconds
+        :param int failure_threshold: Consecutive failures opening the circuit
+        :param float reset_timeout: Seconds before a request is allowed again
+        :param int chunk_size: Read size when scanning response
+        """
+        self.base_url = base_url
+        self.logger = logger
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.chunk_size = chunk_size
+
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.session = None
+
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def generate_configs(self, tenant):
+        """Request config generation, return False if the generator log
+        contains CRITICAL messages or on HTTP error status.
+        Connection errors and exhausted retries are raised.
+        Raise CircuitOpenError if the circuit breaker is open.
+        :param str tenant: Tenant ID
+        """
+        self.check_circuit()
+
+        import requests
+
+        url = urllib.parse.urljoin(self.base_url, "generate_configs?tenant=" + tenant)
+        try:
+            with self.get_session().post(url, timeout=self.timeout, stream=True) as response:
+                if not response.ok:
+                    self.logger.error("Config generator returned HTTP status %d" % response.status_code)
+                    self.record_result(False)
+                    return False
+                critical = self.contains_critical(response)
+        except requests.RequestException:
+            self.record_result(False)
+            raise
+
+        # CRITICAL messages are configuration errors, not service failures
+        self.record_result(True)
+        return not critical
+
+    def get_session(self):
+        """Return HTTP session, created on first request"""
+        with self.lock:
+            if self.session is None:
+                # import requests on first use only
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                # generate_configs is not idempotent: only retry if the
+                # request did not reach the generator, not on 502 or 504,
+                # after which the generation may still be running
+                retry = Retry(
+                    total=self.retries, connect=self.retries, read=0,
+                    status=self.retries, backoff_factor=self.backoff_factor,
+                    status_forcelist=[503],
+                    allowed_methods=False, raise_on_status=False)
+                adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=4)
+                self.session = requests.Session()
+                self.session.mount('http://', adapter)
+                self.session.mount('https://', adapter)
+            return self.session
+
+    def contains_critical(self, response):
+        """Scan response body for CRITICAL marker without buffering it
+        :param Response response: Streamed response
+        """
+        overlap = len(self.CRITICAL_MARKER) - 1
+        tail = b''
+        for chunk in response.iter_content(self.chunk_size):
+            data = tail + chunk
+            if self.CRITICAL_MARKER in data:
+                return True
+            tail = data[-overlap:]
+        return False
+
+    def check_circuit(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("Config generator circuit breaker is open")
+            # half-open: let this request through, reopen on failure
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record_result(self, success):
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self.opened_at is None:
+                self.logger.warning(
+                    "Config generator failed %d times, circuit breaker opened for %ds" %
+                    (self.failures, self.reset_timeout))
+                self.opened_at = time.monotonic()
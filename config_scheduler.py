@@ -0,0 +1,419 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+
+from file_locks import FileLocks
+from metrics import CONFIG_QUEUE_DEPTH
+
+
+class ConfigGenerationQueue:
+    """ConfigGenerationQueue class
+    Queue of config generations of all tenants, run in first come first
+    served order by a fixed number of slots. Each tenant has at most one
+    queued generation, so tenants are served in turn.
+
+    With a lock dir, slots are lock files shared by all worker processes,
+    so that the number of concurrent config generations is bounded across
+    processes. The first generation queued in a process polls for a free
+    slot.
+    """
+
+    def __init__(self, workers=2, max_size=100, lock_dir=None):
+        """Constructor
+        :param int workers: Max number of concurrent config generations
+        :param int max_size: Max number of queued config generations
+        :param str lock_dir: Dir of slot lock files shared by all processes
+        """
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        self.locks = FileLocks(lock_dir) if lock_dir else None
+
+        # waiting entries, [tenant]
+        self.waiting = deque()
+        self.running = []
+        self.average_duration = None
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def slot(self, tenant):
+        """Wait for turn of a tenant and hold a slot while generating
+        :param str tenant: Tenant ID
+        """
+        entry = [tenant]
+        with self.condition:
+            self.waiting.append(entry)
+            self.condition.wait_for(
+                lambda: self.waiting[0] is entry and len(self.running) < self.workers)
+        # first in queue of process, wait for a slot of all processes
+        slot = self.acquire_slot()
+        with self.condition:
+            self.waiting.popleft()
+            self.running.append(tenant)
+            self.condition.notify_all()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            if slot:
+                self.locks.release_slot(slot)
+            with self.condition:
+                self.running.remove(tenant)
+                if self.average_duration is None:
+                    self.average_duration = duration
+                else:
+                    self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+                self.condition.notify_all()
+
+    def acquire_slot(self):
+        """Wait for a free slot of all processes, return it or None without lock dir"""
+        if not self.locks:
+            return None
+        delay = 0.05
+        while True:
+            slot = self.locks.acquire_slot('config-generation', self.workers)
+            if slot:
+                return slot
+            time.sleep(delay)
+            delay = min(2 * delay, 1.0)
+
+    def full(self):
+        with self.condition:
+            return self.max_size > 0 and len(self.waiting) >= self.max_size
+
+    def retry_after(self):
+        """Estimated seconds until a queued config generation is started"""
+        with self.condition:
+            average = self.average_duration if self.average_duration is not None else 5.0
+            return max(1.0, average * len(self.waiting) / self.workers)
+
+    def status(self, tenant):
+        """Return queue status, with position of tenant if it is waiting
+        :param str tenant: Tenant ID
+        """
+        with self.condition:
+            position = None
+            for i, entry in enumerate(self.waiting):
+                if entry[0] == tenant:
+                    position = i + 1
+                    break
+            return {
+                'position': position,
+                'waiting': len(self.waiting),
+                'running': len(self.running),
+                'workers': self.workers
+            }
+
+
+class SharedJobs:
+    """SharedJobs class
+    Config generation jobs of a tenant shared by all worker processes, kept
+    in a JSON file, with a lock file so that only one config generation of
+    the tenant runs at a time in all processes.
+    """
+
+    def __init__(self, jobs_dir, logger, max_jobs=1000):
+        """Constructor
+        :param str jobs_dir: Dir of jobs and lock files
+        :param Logger logger: Application logger
+        :param int max_jobs: Max number of jobs kept for status requests
+        """
+        self.jobs_dir = jobs_dir
+        self.logger = logger
+        self.max_jobs = max_jobs
+        self.jobs_path = os.path.join(jobs_dir, 'jobs.json')
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    @contextmanager
+    def lock(self, name):
+        with open(os.path.join(self.jobs_dir, name + '.lock'), 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def generation(self):
+        """Lock config generation of tenant in all processes"""
+        return self.lock('generate')
+
+    def read(self):
+        try:
+            with open(self.jobs_path, encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {'jobs': {}, 'last_generation': None}
+
+    def save(self, job, generation=False):
+        """Save job status
+        :param dict job: Job status
+        :param bool generation: Save job as last successful config generation
+        """
+        try:
+            with self.lock('jobs'):
+                state = self.read()
+                jobs = state['jobs']
+                jobs[job['job_id']] = job
+                if len(jobs) > self.max_jobs:
+                    latest = sorted(jobs.values(), key=lambda j: j['created'])[-self.max_jobs:]
+                    state['jobs'] = dict((j['job_id'], j) for j in latest)
+                if generation:
+                    state['last_generation'] = {
+                        'job_id': job['job_id'], 'started': job['started']
+                    }
+                fd, tmp_path = tempfile.mkstemp(dir=self.jobs_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+                    json.dump(state, fh)
+                os.replace(tmp_path, self.jobs_path)
+        except OSError as e:
+            self.logger.warning("Unable to save status of config generation %s" % job['job_id'])
+            self.logger.debug("Error : %s" % str(e))
+
+    def get(self, job_id=None):
+        """Return job status, or latest job if job_id is not set
+        :param str job_id: Job ID
+        """
+        jobs = self.read()['jobs']
+        if job_id is None:
+            if not jobs:
+                return None
+            return max(jobs.values(), key=lambda j: j['created'])
+        return jobs.get(job_id)
+
+    def last_generation(self):
+        """Return job ID and start time of last successful config generation"""
+        return self.read().get('last_generation')
+
+
+class ConfigGenerationScheduler:
+    """ConfigGenerationScheduler class
+    Collapse configuration update requests of a tenant received within a
+    quiet window into a single config generation, run in a background thread.
+    Only one config generation of a tenant runs at a time, and config
+    generations of all tenants wait for their turn in a shared queue if set.
+
+    With shared jobs, jobs are visible to all worker processes, config
+    generations of a tenant are serialized across processes, and a job is
+    skipped if a config generation started after its last request has
+    succeeded meanwhile in another process.
+    """
+
+    PENDING = 'pending'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, tenant, generate, logger, delay=2.0, max_jobs=1000, queue=None,
+                 shared_jobs=None):
+        """Constructor
+        :param str tenant: Tenant ID
+        :param func generate: Config generation function, returns True on success
+        :param Logger logger: Application logger
+        :param float delay: Quiet window in seconds
+        :param int max_jobs: Max number of jobs kept for status requests
+        :param ConfigGenerationQueue queue: Queue shared by all tenants
+        :param SharedJobs shared_jobs: Jobs shared by all processes
+        """
+        self.tenant = tenant
+        self.generate = generate
+        self.logger = logger
+        self.delay = delay
+        self.max_jobs = max_jobs
+        self.queue = queue
+        self.shared_jobs = shared_jobs
+
+        # jobs[job_id] = job status dict
+        self.jobs = OrderedDict()
+        self.pending_job = None
+        self.deadline = None
+        self.condition = threading.Condition()
+        self.worker = None
+        self.stopped = False
+
+    def schedule(self, immediate=False):
+        """Request a config generation and return its job ID.
+        Requests are merged into the pending job until the quiet window has
+        elapsed without new requests.
+        :param bool immediate: Start pending job without waiting for quiet window
+        """
+        with self.condition:
+            self.start_worker()
+            if self.pending_job is None:
+                job_id = str(uuid.uuid4())
+                self.pending_job = job_id
+                self.jobs[job_id] = {
+                    'job_id': job_id,
+                    'status': self.PENDING,
+                    'requests': 0,
+                    'created': time.time(),
+                    'updated': None,
+                    'started': None,
+                    'finished': None
+                }
+                while len(self.jobs) > self.max_jobs:
+                    self.jobs.popitem(last=False)
+                created = True
+            else:
+                created = False
+            job = self.jobs[self.pending_job]
+            job['requests'] += 1
+            job['updated'] = time.time()
+            if created:
+                self.save(job)
+            if immediate:
+                self.deadline = time.monotonic()
+            else:
+                self.deadline = time.monotonic() + self.delay
+            self.update_depth()
+            self.condition.notify_all()
+            self.logger.debug("Config generation %s scheduled for tenant %s" % (job['job_id'], self.tenant))
+            return job['job_id']
+
+    def status(self, job_id=None):
+        """Return status of a job, or of latest job if job_id is not set
+        :param str job_id: Job ID
+        """
+        shared_job = None
+        if self.shared_jobs:
+            # job of another process, or latest job of all processes
+            shared_job = self.shared_jobs.get(job_id)
+            if shared_job and job_id is None:
+                job_id = shared_job['job_id']
+        with self.condition:
+            if job_id is None:
+                if not self.jobs:
+                    return None
+                job_id = next(reversed(self.jobs))
+            job = self.jobs.get(job_id)
+            return dict(job) if job else shared_job
+
+    def save(self, job, generation=False):
+        """Save copy of job to shared jobs, called with condition held"""
+        if self.shared_jobs:
+            self.shared_jobs.save(dict(job), generation)
+
+    def has_pending_job(self):
+        """Return True if a new request would be merged into a pending job"""
+        with self.condition:
+            return self.pending_job is not None
+
+    def queue_status(self):
+        """Return number of pending or queued jobs, and shared queue status"""
+        with self.condition:
+            status = {'depth': self.depth()}
+        if self.queue:
+            status.update(self.queue.status(self.tenant))
+        return status
+
+    def depth(self):
+        return sum(
+            1 for job in self.jobs.values()
+            if job['status'] in [self.PENDING, self.QUEUED])
+
+    def update_depth(self):
+        CONFIG_QUEUE_DEPTH.set(self.depth(), tenant=self.tenant)
+
+    def wait(self, job_id, timeout=None):
+        """Wait until a job is finished and return its status
+        :param str job_id: Job ID
+        :param float timeout: Max waiting time in seconds
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.jobs.get(job_id, {}).get('status') in [None, self.SUCCEEDED, self.FAILED],
+                timeout)
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stop(self):
+        """Stop background thread, after starting pending job without waiting
+        for quiet window, when handler is replaced after a config change"""
+        with self.condition:
+            self.stopped = True
+            if self.pending_job is not None:
+                self.deadline = time.monotonic()
+            self.condition.notify_all()
+
+    def start_worker(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(
+                target=self.run, name="config-scheduler-%s" % self.tenant,
+                daemon=True)
+            self.worker.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending_job is None or time.monotonic() < self.deadline:
+                    if self.pending_job is None:
+                        if self.stopped:
+                            return
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(self.deadline - time.monotonic())
+                job = self.jobs.get(self.pending_job)
+                self.pending_job = None
+                if job is None:
+                    continue
+                job['status'] = self.QUEUED
+                self.save(job)
+
+            with self.shared_jobs.generation() if self.shared_jobs else nullcontext():
+                merged_into = self.covering_generation(job)
+                if merged_into:
+                    self.logger.info("Config generation %s for tenant %s merged into %s" % (
+                        job['job_id'], self.tenant, merged_into))
+                    with self.condition:
+                        job['status'] = self.SUCCEEDED
+                        job['merged_into'] = merged_into
+                        job['finished'] = time.time()
+                        self.save(job)
+                        self.update_depth()
+                        self.condition.notify_all()
+                    continue
+                self.run_job(job)
+
+    def covering_generation(self, job):
+        """Return ID of a successful config generation of another process,
+        started after the last request of a job"""
+        if not self.shared_jobs:
+            return None
+        last_generation = self.shared_jobs.last_generation()
+        if last_generation and last_generation['started'] > job['updated']:
+            return last_generation['job_id']
+        return None
+
+    def run_job(self, job):
+        with self.queue.slot(self.tenant) if self.queue else nullcontext():
+            with self.condition:
+                job['status'] = self.RUNNING
+                job['started'] = time.time()
+                self.save(job)
+                self.update_depth()
+
+            self.logger.info("Run config generation %s for tenant %s (%d requests)" % (
+                job['job_id'], self.tenant, job['requests']))
+            try:
+                success = self.generate()
+                error = None
+            except Exception as e:
+                success = False
+                error = str(e)
+                self.logger.error("Unable to generate service configurations")
+                self.logger.debug('Error : "%s"' % error)
+
+        with self.condition:
+            job['status'] = self.SUCCEEDED if success else self.FAILED
+            job['finished'] = time.time()
+            if error:
+                # not 'error', which is the key of failed requests
+                job['message'] = error
+            self.save(job, generation=success)
+            self.condition.notify_all()
@@ -0,0 +1,129 @@
+"""Delta uploads of projects, rsync-style.
+
+The client gets hashes of fixed-size blocks of the current project, then
+sends a delta made of instructions, all integers are big-endian uint32:
+
+    'C' <block index> <block count>   copy blocks of current project
+    'D' <length> <bytes>              literal data
+
+Weak hashes are Adler-32 checksums, which can be rolled over the new
+content one byte at a time to find blocks at any offset, strong hashes
+are SHA-256 hex digests. A reference client encoder is in
+examples/delta_client.py.
+"""
+import hashlib
+import os
+import struct
+import zlib
+
+COPY = b'C'
+DATA = b'D'
+
+
+class DeltaError(Exception):
+    """Raised on invalid delta instructions"""
+    pass
+
+
+def block_hashes(path, block_size):
+    """Return [weak, strong] hashes of the blocks of a file
+    :param str path: File path
+    :param int block_size: Block size in bytes
+    """
+    blocks = []
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            blocks.append([zlib.adler32(block), hashlib.sha256(block).hexdigest()])
+    return blocks
+
+
+class DeltaReader:
+    """DeltaReader class
+    File-like object returning the content rebuilt from the current project
+    and a delta stream, read incrementally so that neither is held in memory.
+    The current project is opened on first read.
+    """
+
+    def __init__(self, base_path, block_size, delta):
+        """Constructor
+        :param str base_path: Current project file path
+        :param int block_size: Block size of delta
+        :param object delta: File-like object with delta instructions
+        """
+        self.base_path = base_path
+        self.block_size = block_size
+        self.delta = delta
+
+        self.base = None
+        self.base_size = 0
+        self.op = None
+        self.offset = 0
+        self.remaining = 0
+        self.error = None
+
+    def read(self, size=-1):
+        try:
+            return self.read_chunk(size)
+        except DeltaError as e:
+            self.error = str(e)
+            raise
+
+    def read_chunk(self, size):
+        if self.base is None:
+            self.base = open(self.base_path, 'rb')
+            self.base_size = os.fstat(self.base.fileno()).st_size
+        if size is None or size < 0:
+            size = float('inf')
+
+        chunks = []
+        length = 0
+        while length < size:
+            if self.remaining == 0 and not self.next_instruction():
+                break
+            want = int(min(size - length, self.remaining))
+            if self.op == COPY:
+                self.base.seek(self.offset)
+                chunk = self.base.read(want)
+                if not chunk:
+                    raise DeltaError("Current project changed while reading")
+                self.offset += len(chunk)
+            else:
+                chunk = self.delta.read(want)
+                if not chunk:
+                    raise DeltaError("Truncated literal data")
+            self.remaining -= len(chunk)
+            length += len(chunk)
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def next_instruction(self):
+        op = self.delta.read(1)
+        if not op:
+            return False
+        if op == COPY:
+            index, count = struct.unpack('>II', self.read_exact(8))
+            blocks = (self.base_size + self.block_size - 1) // self.block_size
+            if count == 0 or index + count > blocks:
+                raise DeltaError("Blocks %d to %d out of range" % (index, index + count - 1))
+            self.op = COPY
+            self.offset = index * self.block_size
+            self.remaining = min(count * self.block_size, self.base_size - self.offset)
+        elif op == DATA:
+            self.op = DATA
+            self.remaining, = struct.unpack('>I', self.read_exact(4))
+        else:
+            raise DeltaError("Unknown instruction %r" % op)
+        return True
+
+    def read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.delta.read(size - len(data))
+            if not chunk:
+                raise DeltaError("Truncated instruction")
+            data += chunk
+        return data
+
+    def close(self):
+        if self.base is not None:
+            self.base.close()
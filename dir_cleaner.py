@@ -0,0 +1,121 @@
+import errno
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EmptyDirCleaner:
+    """EmptyDirCleaner class
+    Remove empty directory trees below a base dir in a single bottom-up pass.
+    Each directory is listed only once, subtrees of the base dir can be
+    processed in parallel, and errors are collected without stopping.
+    Directories locked by a project write are skipped.
+    """
+
+    def __init__(self, base_dir, logger, workers=1, dry_run=False, locks=None):
+        """Constructor
+        :param str base_dir: Base dir, never removed itself
+        :param Logger logger: Application logger
+        :param int workers: Number of threads processing subtrees
+        :param bool dry_run: Only report directories to delete
+        :param FileLocks locks: Directory locks of project writes
+        """
+        self.base_dir = base_dir
+        self.logger = logger
+        self.workers = workers
+        self.dry_run = dry_run
+        self.locks = locks
+
+        self.scanned = 0
+        self.deleted = []
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        """Remove empty directories"""
+        subdirs = [
+            entry.path for entry in os.scandir(self.base_dir)
+            if entry.is_dir(follow_symlinks=False)
+            # skip internal dirs, e.g. version store
+            and not entry.name.startswith('.qwc_publisher')
+        ]
+        if self.workers > 1:
+            with ThreadPoolExecutor(self.workers) as executor:
+                list(executor.map(self.clean, subdirs))
+        else:
+            for subdir in subdirs:
+                self.clean(subdir)
+
+        self.deleted.sort()
+        return self
+
+    def clean(self, path):
+        """Remove empty directories of a tree, return True if path is removed
+        :param str path: Directory path
+        """
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as e:
+            self.add_error(path, e, "Unable to read directory %s")
+            return False
+
+        with self.lock:
+            self.scanned += 1
+
+        empty = True
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not self.clean(entry.path):
+                    empty = False
+            else:
+                empty = False
+
+        if not empty:
+            return False
+
+        if not self.dry_run and not self.remove(path):
+            return False
+
+        with self.lock:
+            self.deleted.append(os.path.relpath(path, self.base_dir))
+        return True
+
+    def remove(self, path):
+        """Remove empty directory, return False if it is in use
+        :param str path: Directory path
+        """
+        if self.locks is None:
+            return self.rmdir(path)
+        with self.locks.directory(os.path.relpath(path, self.base_dir)) as acquired:
+            if not acquired:
+                self.logger.debug("Directory %s in use, not deleted" % path)
+                return False
+            return self.rmdir(path)
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(path)
+            return True
+        except OSError as e:
+            if e.errno in (errno.ENOTEMPTY, errno.EEXIST):
+                # project written since directory was listed
+                return False
+            self.add_error(path, e, "Unable to delete directory %s")
+            return False
+
+    def add_error(self, path, error, msg):
+        reldirpath = os.path.relpath(path, self.base_dir)
+        self.logger.error(msg % path)
+        self.logger.debug("Error : %s" % str(error))
+        with self.lock:
+            self.errors[reldirpath] = str(error)
+
+    def progress(self):
+        """Return current progress"""
+        with self.lock:
+            return {
+                'scanned': self.scanned,
+                'deleted': len(self.deleted),
+                'errors': len(self.errors)
+            }
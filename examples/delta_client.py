@@ -0,0 +1,154 @@
+"""Reference client of delta uploads to /publishdelta.
+
+Gets the block hashes of the current project from /projectblocks, encodes
+the new project as copies of unchanged blocks and literal data, and
+publishes the delta. See delta.py for the delta format.
+
+    python examples/delta_client.py http://127.0.0.1:5100 myproject.qgs myproject.qgs
+"""
+import argparse
+import hashlib
+import os
+import struct
+import sys
+import zlib
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from delta import COPY, DATA
+
+ADLER_MOD = 65521
+
+
+def encode_delta(blocks, block_size, base_size, data):
+    """Return delta of new content against block
+    hashes of current project
+    :param list blocks: [weak, strong] hashes returned by /projectblocks
+    :param int block_size: Block size
+    :param int base_size: Size of current project
+    :param bytes data: New project content
+    """
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        table.setdefault(weak, []).append((index, strong))
+
+    out = []
+    copy = None
+    literal_start = 0
+
+    def flush_literal(end):
+        if end > literal_start:
+            out.append(DATA + struct.pack('>I', end - literal_start) + data[literal_start:end])
+
+    def add_copy(index):
+        nonlocal copy
+        if copy and copy[0] + copy[1] == index:
+            copy[1] += 1
+            return
+        flush_copy()
+        copy = [index, 1]
+
+    def flush_copy():
+        nonlocal copy
+        if copy:
+            out.append(COPY + struct.pack('>II', copy[0], copy[1]))
+            copy = None
+
+    i = 0
+    weak = None
+    while i + block_size <= len(data):
+        if weak is None:
+            weak = zlib.adler32(data[i:i + block_size])
+        match = None
+        for index, strong in table.get(weak, ()):
+            if min(block_size, base_size - index * block_size) == block_size and \
+                    hashlib.sha256(data[i:i + block_size]).hexdigest() == strong:
+                match = index
+                break
+        if match is not None:
+            if i > literal_start:
+                flush_copy()
+                flush_literal(i)
+            add_copy(match)
+            i += block_size
+            literal_start = i
+            weak = None
+            continue
+        if i + block_size < len(data):
+            # roll weak hash by one byte
+            a, b = weak & 0xffff, weak >> 16
+            out_byte, in_byte = data[i], data[i + block_size]
+            a = (a - out_byte + in_byte) % ADLER_MOD
+            b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+            weak = (b << 16) | a
+        i += 1
+
+    # shorter last block of current project can only match at the end
+    last_size = base_size % block_size
+    tail = data[len(data) - last_size:] if last_size else b''
+    if blocks and last_size and len(data) - last_size >= literal_start and \
+            hashlib.sha256(tail).hexdigest() == blocks[-1][1]:
+        if len(data) - last_size > literal_start:
+            flush_copy()
+            flush_literal(len(data) - last_size)
+        add_copy(len(blocks) - 1)
+        literal_start = len(data)
+    if len(data) > literal_start:
+        flush_copy()
+        flush_literal(len(data))
+    flush_copy()
+    return b''.join(out)
+
+
+def publish_delta(url, filename, data, block_size=None, sync=False, session=None):
+    """Publish new project content as delta against the current project,
+    return response of /publishdelta
+    :param str url: Service base URL
+    :param str filename: Relative project path
+    :param bytes data: New project content
+    :param int block_size: Block size, default of service if not set
+    :param bool sync: Wait for service configurations update
+    :param Session session: Requests session
+    """
+    session = session or requests.Session()
+    url = url.rstrip('/')
+    params = {'filename': filename}
+    if block_size:
+        params['block_size'] = block_size
+    response = session.get(url + '/projectblocks', params=params)
+    response.raise_for_status()
+    blocks = response.json()
+    if 'error' in blocks:
+        raise ValueError(blocks['error'])
+
+    delta = encode_delta(blocks['blocks'], blocks['block_size'], blocks['size'], data)
+    return session.post(url + '/publishdelta', params={
+        'filename': filename,
+        'block_size': blocks['block_size'],
+        'base_sha256': blocks['sha256'],
+        'sha256': hashlib.sha256(data).hexdigest(),
+        'sync': 'true' if sync else 'false'
+    }, data=delta, headers={'Content-Type': 'application/octet-stream'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url', help='Service base URL')
+    parser.add_argument('filename', help='Relative project path in scan dir')
+    parser.add_argument('path', help='Local file with new project content')
+    parser.add_argument('--block-size', type=int, help='Block size in bytes')
+    parser.add_argument('--sync', action='store_true',
+                        help='Wait for service configurations update')
+    args = parser.parse_args()
+
+    with open(args.path, 'rb') as fh:
+        data = fh.read()
+    response = publish_delta(args.url, args.filename, data, args.block_size, args.sync)
+    print(response.text)
+    return 0 if response.ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
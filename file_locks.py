@@ -0,0 +1,109 @@
+import fcntl
+import hashlib
+import os
+from contextlib import ExitStack, contextmanager
+
+
+class FileLocks:
+    """FileLocks class
+    Project and directory locks shared by all worker processes, based on
+    flock on lock files. Keys are hashed onto a fixed number of lock files
+    per kind, so that the number of lock files is bounded and writes to
+    different projects do not wait for each other.
+
+    Writers hold an exclusive lock on their project and shared locks on all
+    its parent dirs, so a directory is only removed while no project below
+    it is being written.
+
+    Slots bound the number of concurrent operations of a kind across
+    processes, each holding one of a fixed number of lock files.
+    """
+
+    def __init__(self, lock_dir, stripes=1024):
+        """Constructor
+        :param str lock_dir: Dir of lock files
+        :param int stripes: Number of lock files per kind
+        """
+        self.lock_dir = lock_dir
+        self.stripes = max(1, stripes)
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def lock_path(self, kind, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(
+            self.lock_dir, '%s-%d.lock' % (kind, int(digest[:8], 16) % self.stripes))
+
+    @contextmanager
+    def lock(self, kind, key, shared=False, blocking=True):
+        """Acquire lock, yield False if not blocking and lock is busy
+        :param str kind: 'project' or 'dir'
+        :param str key: Relative path
+        :param bool shared: Acquire shared lock
+        :param bool blocking: Wait for lock
+        """
+        operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        with open(self.lock_path(kind, key), 'a') as fh:
+            try:
+                fcntl.flock(fh, operation)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def acquire_slot(self, kind, count):
+        """Lock one of count slot files, return it, or None if all are busy
+        :param str kind: Kind of slots, e.g. 'upload'
+        :param int count: Number of slots
+        """
+        for i in range(count):
+            fh = open(os.path.join(self.lock_dir, '%s-slot-%d.lock' % (kind, i)), 'a')
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fh
+            except BlockingIOError:
+                fh.close()
+        return None
+
+    def release_slot(self, slot):
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+    @contextmanager
+    def slot(self, kind, count):
+        """Try to lock one of count slot files shared by all processes,
+        yield False if all are busy
+        :param str kind: Kind of slots, e.g. 'upload'
+        :param int count: Number of slots
+        """
+        slot = self.acquire_slot(kind, count)
+        if slot is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            self.release_slot(slot)
+
+    @contextmanager
+    def project(self, relpath):
+        """Lock project for writing, with shared locks on its parent dirs
+        :param str relpath: Project path relative to scan dir
+        """
+        with ExitStack() as stack:
+            parts = os.path.normpath(relpath).split(os.sep)[:-1]
+            for i in range(len(parts)):
+                stack.enter_context(
+                    self.lock('dir', os.path.join(*parts[:i + 1]), shared=True))
+            stack.enter_context(self.lock('project', os.path.normpath(relpath)))
+            yield
+
+    def directory(self, reldir):
+        """Try to lock a directory for removal, yield False if it is in use
+        :param str reldir: Dir path relative to scan dir
+        """
+        return self.lock('dir', os.path.normpath(reldir), blocking=False)
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class HashIndex:
+    """HashIndex class
+    Persisted index of SHA-256 hashes of project files of a storage.
+    Entries are validated against file size and mtime, and missing or outdated
+    hashes are read from object metadata or computed lazily from disk.
+    Changes are persisted at most every flush_interval seconds, and by flush().
+    """
+
+    def __init__(self, storage, index_path, logger, chunk_size=1024 * 1024,
+                 flush_interval=5):
+        """Constructor
+        :param Storage storage: Project storage
+        :param str index_path: Path of persisted JSON index
+        :param Logger logger: Application logger
+        :param int chunk_size: Read size for hashing files
+        :param float flush_interval: Min interval in seconds between saves of index
+        """
+        self.storage = storage
+        self.index_path = index_path
+        self.logger = logger
+        self.chunk_size = chunk_size
+
+        # entries[relpath] = [size, mtime_ns, sha256]
+        self.entries = None
+        self.lock = threading.RLock()
+        self.flush_interval = flush_interval
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def load(self):
+        """Load persisted index on first use"""
+        with self.lock:
+            if self.entries is not None:
+                return
+            self.entries = {}
+            if self.index_path and os.path.exists(self.index_path):
+                try:
+                    with open(self.index_path, encoding='utf-8') as fh:
+                        self.entries = json.load(fh)
+                except Exception as e:
+                    self.logger.warning("Could not load hash index '%s'" % self.index_path)
+                    self.logger.debug("Error : %s" % str(e))
+
+    def changed(self):
+        """Mark index as changed, and save it if last save is older than flush_interval"""
+        with self.lock:
+            self.dirty = True
+            if time.monotonic() - self.saved_at >= self.flush_interval:
+                self.save()
+
+    def flush(self):
+        """Save index if it has unsaved changes"""
+        with self.lock:
+            if self.dirty:
+                self.save()
+
+    def save(self):
+        """Persist index atomically"""
+        if not self.index_path:
+            return
+        with self.lock:
+            self.dirty = False
+            self.saved_at = time.monotonic()
+            try:
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=os.path.dirname(self.index_path), suffix='.tmp')
+                with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+                    json.dump(self.entries, fh)
+                os.replace(tmp_path, self.index_path)
+            except Exception as e:
+                self.logger.warning("Could not save hash index '%s'" % self.index_path)
+                self.logger.debug("Error : %s" % str(e))
+
+    def get(self, relpath, stat=None):
+        """Return SHA-256 of a project file, or None if it does not exist
+        :param str relpath: Path relative to base dir
+        :param os.stat_result stat: File stat, if already known
+        """
+        self.load()
+        try:
+            if stat is None:
+                stat = self.storage.stat(relpath)
+        except OSError:
+            self.remove(relpath)
+            return None
+
+        with self.lock:
+            entry = self.entries.get(relpath)
+            if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                return entry[2]
+
+        try:
+            sha256 = getattr(stat, 'sha256', None) or \
+                self.hash_file(self.storage.fetch(relpath))
+        except OSError:
+            return None
+        with self.lock:
+            self.entries[relpath] = [stat.st_size, stat.st_mtime_ns, sha256]
+            self.changed()
+        return sha256
+
+    def set(self, relpath, sha256):
+        """Store SHA-256 of a written project file
+        :param str relpath: Path relative to base dir
+        :param str sha256: SHA-256 hex digest
+        """
+        self.load()
+        stat = self.storage.stat(relpath)
+        with self.lock:
+            self.entries[relpath] = [stat.st_size, stat.st_mtime_ns, sha256]
+            self.changed()
+
+    def remove(self, relpath):
+        """Remove project file from index
+        :param str relpath: Path relative to base dir
+        """
+        self.load()
+        with self.lock:
+            if self.entries.pop(relpath, None) is not None:
+                self.changed()
+
+    def hash_file(self, path):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(self.chunk_size), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
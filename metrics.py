@@ -0,0 +1,184 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+]
+
+
+class Metric:
+    """Metric base class
+    Values are kept per label values tuple, each metric has its own lock
+    which is only held for updating a single value.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, description, labelnames=()):
+        """Constructor
+        :param str name: Metric name
+        :param str description: Help text
+        :param tuple labelnames: Label names
+        """
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def format_labels(self, label_values, extra=()):
+        pairs = list(zip(self.labelnames, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in pairs)
+
+    def expose(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.description),
+            '# TYPE %s %s' % (self.name, self.TYPE)
+        ]
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in sorted(values):
+            lines += self.sample_lines(label_values, value)
+        return lines
+
+    def sample_lines(self, label_values, value):
+        return ['%s%s %s' % (self.name, self.format_labels(label_values), repr(float(value)))]
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, description, labelnames)
+        self.buckets = list(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [bucket counts (last is +Inf), sum, count]
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.values[key] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def sample_lines(self, label_values, value):
+        counts, total, count = value[0], value[1], value[2]
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ['+Inf'], counts):
+            cumulative += bucket_count
+            le = bound if bound == '+Inf' else repr(float(bound))
+            lines.append('%s_bucket%s %d' % (
+                self.name, self.format_labels(label_values, [('le', le)]), cumulative))
+        lines.append('%s_sum%s %s' % (self.name, self.format_labels(label_values), repr(total)))
+        lines.append('%s_count%s %d' % (self.name, self.format_labels(label_values), count))
+        return lines
+
+
+class Registry:
+    """Registry of metrics, exposed in Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.expose()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'publisher_requests_total', 'Number of HTTP requests',
+    ('route', 'method', 'status', 'tenant')))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'publisher_request_duration_seconds', 'HTTP request duration',
+    ('route', 'method', 'tenant')))
+
+ACCESS_CONTROL_QUERY_DURATION = REGISTRY.register(Histogram(
+    'publisher_access_control_query_seconds', 'Config DB publisher role query duration',
+    ('tenant',)))
+ACCESS_CONTROL_CACHE_HITS = REGISTRY.register(Counter(
+    'publisher_access_control_cache_hits_total', 'Publisher role decisions read from cache',
+    ('tenant',)))
+
+UPLOAD_WRITE_DURATION = REGISTRY.register(Histogram(
+    'publisher_upload_write_seconds', 'Project upload write duration',
+    ('tenant',)))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    'publisher_upload_bytes_total', 'Written project bytes',
+    ('tenant',)))
+UPLOAD_UNCHANGED = REGISTRY.register(Counter(
+    'publisher_upload_unchanged_total', 'Published projects with unchanged content',
+    ('tenant',)))
+
+CONFIG_UPDATE_DURATION = REGISTRY.register(Histogram(
+    'publisher_config_update_seconds', 'Config generator request duration',
+    ('tenant',)))
+CONFIG_UPDATE_FAILURES = REGISTRY.register(Counter(
+    'publisher_config_update_failures_total', 'Failed service configurations updates',
+    ('tenant', 'reason')))
+CONFIG_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'publisher_config_queue_depth', 'Pending or queued service configurations updates',
+    ('tenant',)))
+
+RATE_LIMITED = REGISTRY.register(Counter(
+    'publisher_rate_limited_total', 'Write requests rejected with status 429',
+    ('tenant', 'reason')))
+UPLOADS_IN_PROGRESS = REGISTRY.register(Gauge(
+    'publisher_uploads_in_progress', 'Running project uploads',
+    ('tenant',)))
+
+PROJECT_SCAN_DURATION = REGISTRY.register(Histogram(
+    'publisher_project_scan_seconds', 'QWC2 scan dir walk duration',
+    ('tenant',)))
+PROJECT_SCAN_FILES = REGISTRY.register(Gauge(
+    'publisher_project_scan_files', 'Number of files found by last QWC2 scan dir walk',
+    ('tenant',)))
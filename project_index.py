@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+
+from metrics import PROJECT_SCAN_DURATION, PROJECT_SCAN_FILES
+
+
+class ProjectIndex:
+    """ProjectIndex class
+    In-memory index of files in QWC2 scan dir, kept up to date by
+    publish and delete, and by periodic rescans for out-of-band changes.
+
+    Changes of other worker processes are read from the tenant change log
+    and applied to the index on the next listing, without rescanning.
+    """
+
+    def __init__(self, base_dir, storage, changelog, tenant, logger, poll_interval=60):
+        """Constructor
+        :param str base_dir: QWC2 scan dir
+        :param Storage storage: Project storage
+        :param ChangeLog changelog: Tenant change log
+        :param str tenant: Tenant ID
+        :param Logger logger: Application logger
+        :param float poll_interval: Rescan interval in seconds, 0 to disable
+        """
+        self.base_dir = base_dir
+        self.storage = storage
+        self.changelog = changelog
+        self.tenant = tenant
+        self.logger = logger
+        self.poll_interval = poll_interval
+
+        # entries[relpath] = {'size': ..., 'mtime': ..., 'sha256': ...}
+        self.entries = None
+        self.sorted_paths = None
+        # sequence number of last change log entry applied to index
+        self.seq = None
+        self.last_scan = None
+        self.lock = threading.RLock()
+        self.watcher = None
+        self.stopped = threading.Event()
+
+    def scan(self, prefix=''):
+        """Rebuild index from storage
+        :param str prefix: Only rescan files whose relative path starts with prefix
+        """
+        if self.entries is None:
+            prefix = ''
+        start = time.time()
+        # changes logged while scanning are applied again on next listing
+        seq = self.changelog.current_seq()
+        entries = {}
+        for relpath, stat in self.storage.list(prefix):
+            entries[relpath] = self.entry(stat, relpath)
+
+        with self.lock:
+            if prefix:
+                for relpath in list(self.entries):
+                    if relpath.startswith(prefix) and relpath not in entries:
+                        del self.entries[relpath]
+                self.entries.update(entries)
+            else:
+                self.entries = entries
+                self.seq = seq
+                self.last_scan = time.time()
+            self.sorted_paths = None
+
+        duration = time.time() - start
+        PROJECT_SCAN_DURATION.observe(duration, tenant=self.tenant)
+        PROJECT_SCAN_FILES.set(len(entries), tenant=self.tenant)
+        self.logger.debug("Indexed %d files in %s in %.3fs" % (
+            len(entries), self.base_dir, duration))
+
+    def entry(self, stat, relpath, sha256=None):
+        if sha256 is None and self.entries:
+            # keep known hash of unchanged files
+            previous = self.entries.get(relpath)
+            if previous and previous['size'] == stat.st_size and \
+                    previous['mtime'] == stat.st_mtime:
+                sha256 = previous['sha256']
+        return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': sha256}
+
+    def ensure_loaded(self, rescan=False, prefix=''):
+        """Scan if index is empty, outdated or if rescan is forced
+        :param bool rescan: Force rescan
+        :param str prefix: Only rescan files whose relative path starts with prefix,
+                           if rescan is forced
+        """
+        self.start_watcher()
+        if self.entries is None:
+            self.scan()
+        elif rescan:
+            self.scan(prefix)
+        else:
+            self.apply_changes()
+
+    def apply_changes(self):
+        """Apply changes logged by all processes since last scan or listing"""
+        while True:
+            with self.lock:
+                seq = self.seq
+            changes, truncated = self.changelog.since(seq, 10000)
+            if truncated:
+                self.scan()
+                return
+            if not changes:
+                return
+            for change in changes:
+                if change['event'] in ['published', 'deleted']:
+                    self.refresh_entry(change['path'], change.get('sha256'))
+            with self.lock:
+                self.seq = max(self.seq, changes[-1]['seq'])
+
+    def refresh_entry(self, relpath, sha256=None):
+        try:
+            stat = self.storage.stat(relpath)
+        except OSError:
+            stat = None
+        with self.lock:
+            if self.entries is None:
+                return
+            if stat is None:
+                if self.entries.pop(relpath, None) is not None:
+                    self.sorted_paths = None
+                return
+            if relpath not in self.entries:
+                self.sorted_paths = None
+            self.entries[relpath] = self.entry(stat, relpath, sha256)
+
+    def update(self, relpath, sha256=None):
+        """Add or update a file after it has been written
+        :param str relpath: Path relative to scan dir
+        :param str sha256: SHA-256 of file content, if known
+        """
+        self.refresh_entry(relpath, sha256)
+
+    def remove(self, relpath):
+        """Remove a deleted file
+        :param str relpath: Path relative to scan dir
+        """
+        with self.lock:
+            if self.entries is not None and self.entries.pop(relpath, None):
+                self.sorted_paths = None
+
+    def list(self, extensions, prefix='', rescan=False):
+        """Return sorted relative paths of files with allowed extensions
+        :param list extensions: list of allowed extensions
+        :param str prefix: Only return paths starting with prefix
+        :param bool rescan: Force rescan
+        """
+        self.ensure_loaded(rescan, prefix)
+        with self.lock:
+            if self.sorted_paths is None:
+                self.sorted_paths = sorted(self.entries)
+            paths = self.sorted_paths
+        return [
+            path for path in paths
+            if path.startswith(prefix) and
+            os.path.splitext(path)[1][1:] in extensions
+        ]
+
+    def get(self, relpath):
+        """Return index entry of a file, or None"""
+        self.ensure_loaded()
+        with self.lock:
+            return self.entries.get(relpath)
+
+    def start_watcher(self):
+        if self.poll_interval <= 0 or self.stopped.is_set():
+            return
+        if self.watcher is None or not self.watcher.is_alive():
+            self.watcher = threading.Thread(
+                target=self.watch, name="project-index-%s" % self.base_dir,
+                daemon=True)
+            self.watcher.start()
+
+    def stop(self):
+        """Stop periodic rescans"""
+        self.stopped.set()
+
+    def watch(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                self.scan()
+            except Exception as e:
+                self.logger.warning("Could not scan '%s'" % self.base_dir)
+                self.logger.debug("Error : %s" % str(e))
@@ -1,9 +1,33 @@
+import hashlib
 import os
-import urllib
-import requests
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
 
-from pathlib import Path
-from qwc_services_core.runtime_config import RuntimeConfig
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from changelog import ChangeLog
+from compression import CompressionCache, LimitedReader, SizeLimitError
+from config_generator_client import CircuitOpenError, ConfigGeneratorClient
+from config_scheduler import ConfigGenerationScheduler, SharedJobs
+from delta import DeltaReader, block_hashes
+from dir_cleaner import EmptyDirCleaner
+from file_locks import FileLocks
+from hash_index import HashIndex
+from metrics import CONFIG_UPDATE_DURATION, CONFIG_UPDATE_FAILURES, RATE_LIMITED, \
+    UPLOAD_BYTES, UPLOAD_UNCHANGED, UPLOAD_WRITE_DURATION, UPLOADS_IN_PROGRESS
+from project_index import ProjectIndex
+from project_summary import ProjectValidator, SummaryStore
+from rate_limit import TokenBucket
+from storage import LocalStorage, S3Storage
+from version_store import VersionStore, valid_sha256
+
+# process umask, applied to project files written through temporary files
+UMASK = os.umask(0)
+os.umask(UMASK)
 
 
 class ProjectPublisherService:
@@ -11,16 +35,135 @@ class ProjectPublisherService:
     Add a QWC2 webservice to publish or delete a qgis project.
     """
 
-    def __init__(self, tenant, logger):
+    def __init__(self, tenant, logger, config, config_queue=None):
         """Constructor
         :param str tenant: Tenant ID
         :param Logger logger: Application logger
+        :param RuntimeConfig config: Tenant config
+        :param ConfigGenerationQueue config_queue: Config generation queue shared by all tenants
         """
         self.tenant = tenant
         self.logger = logger
+        self.config = config
+
+        self.config_generator = ConfigGeneratorClient(
+            self.config.get('config_generator_service_url', "http://qwc-config-service:9090"),
+            logger,
+            connect_timeout=float(self.config.get('config_generator_connect_timeout', 5)),
+            read_timeout=float(self.config.get('config_generator_read_timeout', 300)),
+            retries=int(self.config.get('config_generator_retries', 3)),
+            backoff_factor=float(self.config.get('config_generator_backoff_factor', 0.5)),
+            failure_threshold=int(self.config.get('config_generator_failure_threshold', 5)),
+            reset_timeout=float(self.config.get('config_generator_reset_timeout', 60)))
+        shared_jobs = None
+        config_jobs_dir = self.config.get('config_jobs_dir')
+        if not config_jobs_dir and self.config.get("qgis_projects_scan_base_dir"):
+            config_jobs_dir = os.path.join(
+                self.config.get("qgis_projects_scan_base_dir"), '.qwc_publisher_config_jobs')
+        if config_jobs_dir:
+            shared_jobs = SharedJobs(config_jobs_dir, logger)
+        self.config_scheduler = ConfigGenerationScheduler(
+            tenant, self.update_config, logger,
+            delay=float(self.config.get('update_config_delay', 2)), queue=config_queue,
+            shared_jobs=shared_jobs)
+        self.config_queue = config_queue
+
+        qgis_projects_scan_base_dir = self.config.get("qgis_projects_scan_base_dir")
+        self.locks = None
+        if qgis_projects_scan_base_dir:
+            self.locks = FileLocks(
+                self.config.get('lock_dir', os.path.join(
+                    qgis_projects_scan_base_dir, '.qwc_publisher_locks')),
+                int(self.config.get('lock_stripes', 1024)))
+
+        # per tenant limits of write requests, shared by all processes if
+        # lock dir is set
+        self.rate_limiter = None
+        publish_rate_limit = float(self.config.get('publish_rate_limit', 0))
+        if publish_rate_limit > 0:
+            self.rate_limiter = TokenBucket(
+                publish_rate_limit, float(self.config.get('publish_rate_burst', 10)),
+                os.path.join(self.locks.lock_dir, 'rate_limit.json') if self.locks else None)
+        self.max_uploads = int(self.config.get('max_concurrent_uploads', 0))
+        self.uploads = 0
+        self.uploads_lock = threading.Lock()
+
+        self.changelog = None
+        self.storage = None
+        self.hash_index = None
+        self.project_index = None
+        if qgis_projects_scan_base_dir:
+            if self.config.get('storage_backend', 'local') == 's3':
+                self.storage = S3Storage(
+                    self.config.get('s3_cache_dir', os.path.join(
+                        qgis_projects_scan_base_dir, '.qwc_publisher_cache')),
+                    self.config.get('s3_bucket'), logger,
+                    prefix=self.config.get('s3_prefix', ''),
+                    endpoint_url=self.config.get('s3_endpoint_url'),
+                    region=self.config.get('s3_region'),
+                    stat_cache_ttl=float(self.config.get('storage_stat_cache_ttl', 5)),
+                    multipart_threshold=int(self.config.get('s3_multipart_threshold', 8 * 1024 * 1024)),
+                    multipart_chunksize=int(self.config.get('s3_multipart_chunksize', 8 * 1024 * 1024)),
+                    page_size=int(self.config.get('s3_list_page_size', 1000)))
+            else:
+                self.storage = LocalStorage(
+                    qgis_projects_scan_base_dir,
+                    float(self.config.get('storage_stat_cache_ttl', 0)))
+            self.changelog = ChangeLog(
+                self.config.get('changelog_path', os.path.join(
+                    qgis_projects_scan_base_dir, '.qwc_publisher_changelog', 'changes.jsonl')),
+                logger, int(self.config.get('changelog_buffer_size', 1000)),
+                int(self.config.get('changelog_max_entries', 100000)))
+            self.hash_index = HashIndex(
+                self.storage,
+                self.config.get('hash_index_path', os.path.join(
+                    qgis_projects_scan_base_dir, '.qwc_publisher_hashes.json')),
+                logger, int(self.config.get('upload_chunk_size', 1024 * 1024)))
+            self.project_index = ProjectIndex(
+                qgis_projects_scan_base_dir, self.storage, self.changelog, tenant, logger,
+                float(self.config.get('project_index_poll_interval', 60)))
+
+        self.summary_store = None
+        if qgis_projects_scan_base_dir:
+            self.summary_store = SummaryStore(
+                self.config.get('summaries_dir', os.path.join(
+                    qgis_projects_scan_base_dir, '.qwc_publisher_summaries')),
+                logger, int(self.config.get('summary_cache_size', 10000)),
+                int(self.config.get('upload_chunk_size', 1024 * 1024)))
 
-        self.config_handler = RuntimeConfig("projectPublisher", logger)
-        self.config = self.config_handler.tenant_config(tenant)
+        self.version_store = None
+        versions_enable = str(self.config.get('versions_enable', True)).lower() != 'false'
+        if qgis_projects_scan_base_dir and versions_enable:
+            self.version_store = VersionStore(
+                self.config.get('versions_dir', os.path.join(
+                    qgis_projects_scan_base_dir, '.qwc_publisher_versions')),
+                logger,
+                compress=str(self.config.get('versions_compress', False)).lower() == 'true',
+                max_versions=int(self.config.get('versions_max_count', 10)),
+                max_bytes=int(self.config.get('versions_max_bytes', 0)))
+
+        # clean_jobs[job_id] = {'cleaner': ..., 'result': ...}
+        self.clean_jobs = OrderedDict()
+        self.clean_jobs_lock = threading.Lock()
+
+        # block hashes of recently requested projects, by (sha256, block size)
+        self.block_hashes_cache = OrderedDict()
+        self.block_hashes_lock = threading.Lock()
+
+        self.compression_cache = CompressionCache(
+            self.config.get('compression_cache_dir', os.path.join(
+                tempfile.gettempdir(), 'qwc-project-publisher', tenant)),
+            logger, int(self.config.get('upload_chunk_size', 1024 * 1024)))
+
+    def close(self):
+        """Stop background tasks, when handler is replaced after a config change"""
+        if self.project_index:
+            self.project_index.stop()
+        if self.changelog:
+            self.changelog.close()
+        self.config_scheduler.stop()
+        if self.hash_index:
+            self.hash_index.flush()
 
     def error_result(self, message):
         result = {'error': message}
@@ -30,6 +173,58 @@ class ProjectPublisherService:
         result = {'success': message}
         return result
 
+    def rejected_result(self, message, retry_after, reason):
+        RATE_LIMITED.inc(tenant=self.tenant, reason=reason)
+        self.logger.warning(message)
+        result = self.error_result(message)
+        result['retry_after'] = retry_after
+        return result
+
+    def throttle(self):
+        """Apply rate limit of tenant and config generation queue limit to
+        a write request, return rejection result or None if allowed
+        """
+        if self.rate_limiter:
+            retry_after = self.rate_limiter.acquire()
+            if retry_after > 0:
+                return self.rejected_result(
+                    "Too many publish requests for tenant '%s'" % self.tenant, retry_after, 'rate')
+        if self.config_queue and self.update_config_enabled() and \
+                not self.config_scheduler.has_pending_job() and self.config_queue.full():
+            return self.rejected_result(
+                "Too many pending service configurations updates",
+                self.config_queue.retry_after(), 'queue')
+        return None
+
+    @contextmanager
+    def upload_slot(self):
+        """Count running upload of tenant, yield rejection result if too many
+        uploads are running, else None
+        """
+        slot = None
+        with self.uploads_lock:
+            if self.max_uploads > 0 and self.locks:
+                # slots of all processes
+                slot = self.locks.acquire_slot('upload', self.max_uploads)
+                rejected = slot is None
+            else:
+                rejected = self.max_uploads > 0 and self.uploads >= self.max_uploads
+            if not rejected:
+                self.uploads += 1
+                UPLOADS_IN_PROGRESS.set(self.uploads, tenant=self.tenant)
+        if rejected:
+            yield self.rejected_result(
+                "Too many concurrent uploads for tenant '%s'" % self.tenant, 1, 'uploads')
+            return
+        try:
+            yield None
+        finally:
+            with self.uploads_lock:
+                if slot:
+                    self.locks.release_slot(slot)
+                self.uploads -= 1
+                UPLOADS_IN_PROGRESS.set(self.uploads, tenant=self.tenant)
+
     def output_path(self, relpath):
         projects_scan_path = self.config.get("qgis_projects_scan_base_dir")
         self.logger.debug("projects_scan_path : %s" % projects_scan_path)
@@ -39,94 +234,613 @@ class ProjectPublisherService:
                 relpath = relpath[1:]
             output_path = os.path.join(projects_scan_path, relpath)
             self.logger.debug("output_path : %s" % output_path)
+            base_path = os.path.join(os.path.abspath(projects_scan_path), '')
+            if not os.path.abspath(output_path).startswith(base_path):
+                self.logger.warning("'%s' is outside of qgis_projects_scan_base_dir" % relpath)
+                return ''
             return output_path
         else:
             self.logger.warning("qgis_projects_scan_base_dir not defined")
             return ''
 
-    def publish(self, filename, file):
-        """Publish QGIS project
-        :param obj filename: .qgs project file name
-        :param object file: POST request file
+    def allowed_file(self, filename, allowed_extensions):
+        """Check project file extension
+        :param str filename: Project file name
+        :param list allowed_extensions: list of allowed extensions
         """
+        return '.' in filename and \
+            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+    def update_config_enabled(self):
+        return str(self.config.get('update_config_enable', True)).lower() != 'false'
+
+    def write_project(self, filename, file, expected_sha256=None, verify_sha256=None):
+        """Write QGIS project file in QWC2 scan dir.
+        Content is streamed to a temporary file in the target directory,
+        then atomically renamed, so that readers never see a partial project.
+        :param str filename: .qgs project file name
+        :param object file: File-like object with project content
+        :param str expected_sha256: Fail with conflict if current project has another SHA-256,
+                                    '*' if project must exist
+        :param str verify_sha256: Fail if written content has another SHA-256
+        """
         project_file_out = self.output_path(filename)
 
         self.logger.debug("Tenant : %s" % self.tenant)
         self.logger.info("Try to write data to '%s'" % project_file_out)
 
-        if project_file_out:
-            try:
-                os.makedirs(os.path.dirname(project_file_out), exist_ok=True)
-                file.seek(0)
-                file.save(project_file_out)
-                self.logger.info("Project '%s' successfully saved" % filename)
+        if not project_file_out:
+            return self.error_result("Project cant not be published. Contact GIS Administrator")
 
-            except Exception as e:
-                msg = "Unable to write in file %s" % project_file_out
-                self.logger.error(msg)
-                self.logger.debug('Error : "%s"' % str(e))
+        relpath = os.path.relpath(project_file_out, self.config.get("qgis_projects_scan_base_dir"))
+        project_file_out = self.storage.path(relpath)
+        with self.locks.project(relpath):
+            try:
+                return self.write_locked_project(
+                    filename, file, project_file_out, relpath, expected_sha256, verify_sha256)
+            except SizeLimitError as e:
+                msg = "Project file exceeds max size: %s" % str(e)
+                self.logger.error("%s : %s" % (msg, filename))
                 return self.error_result(msg)
 
-            update_config_enable = str(self.config.get('update_config_enable', True)).lower() != 'false'
+    def max_decompressed_size(self):
+        """Max size in bytes of decompressed uploads, so that small compressed
+        bodies can not fill the disk"""
+        return int(self.config.get('max_project_file_size', 0)) or \
+            int(self.config.get('max_decompressed_size', 1024 * 1024 * 1024))
 
-            if update_config_enable:
-                try:
-                    if self.update_config():
-                        return self.success_result("Project '%s' successfully published" % filename)
-                    else:
-                        return self.error_result("Project saved but unable to generate service configurations")
-                except Exception as e:
-                    msg = "Unable to generate service configurations"
-                    self.logger.error(msg)
-                    self.logger.debug('Error : "%s"' % str(e))
+    def write_locked_project(self, filename, file, project_file_out, relpath, expected_sha256,
+                             verify_sha256=None):
+        max_size = int(self.config.get('max_project_file_size', 0))
+        chunk_size = int(self.config.get('upload_chunk_size', 1024 * 1024))
+        current_sha256 = self.hash_index.get(relpath)
+        if not self.version_matches(expected_sha256, current_sha256):
+            return self.conflict_result(filename, expected_sha256, current_sha256)
+
+        validator = None
+        if self.validation_enabled() and project_file_out.lower().endswith('.qgs'):
+            validator = ProjectValidator()
+
+        if current_sha256 and self.rewind(file):
+            # compare content before writing anything
+            sha256 = hashlib.sha256()
+            size = 0
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                size += len(chunk)
+                sha256.update(chunk)
+            if sha256.hexdigest() == current_sha256:
+                return self.unchanged_result(filename, current_sha256, size)
+
+        tmp_path = None
+        start = time.perf_counter()
+        try:
+            project_dir = os.path.dirname(project_file_out)
+            os.makedirs(project_dir, exist_ok=True)
+            self.rewind(file)
+
+            fd, tmp_path = tempfile.mkstemp(
+                dir=project_dir, prefix=".%s." % os.path.basename(project_file_out), suffix='.tmp')
+            sha256 = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as project:
+                while True:
+                    chunk = file.read(chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size and size > max_size:
+                        msg = "Project file exceeds max size of %d bytes" % max_size
+                        self.logger.error("%s : %s" % (msg, filename))
+                        return self.error_result(msg)
+                    if validator and not validator.feed(chunk):
+                        # reject before the current project is replaced
+                        msg = "Invalid QGIS project: %s" % validator.error
+                        self.logger.error("%s : %s" % (msg, filename))
+                        return self.error_result(msg)
+                    sha256.update(chunk)
+                    project.write(chunk)
+                if verify_sha256 and sha256.hexdigest() != verify_sha256:
+                    msg = "Checksum mismatch, expected %s but got %s" % (
+                        verify_sha256, sha256.hexdigest())
+                    self.logger.error("%s : %s" % (msg, filename))
                     return self.error_result(msg)
-            else:
-                return self.success_result("Project '%s' successfully saved but not published, update config is disabled" % filename)
+                if sha256.hexdigest() == current_sha256:
+                    # not seekable upload, discard temporary file
+                    return self.unchanged_result(filename, current_sha256, size)
+                summary = validator.close() if validator else None
+                if validator and summary is None:
+                    msg = "Invalid QGIS project: %s" % validator.error
+                    self.logger.error("%s : %s" % (msg, filename))
+                    return self.error_result(msg)
+                project.flush()
+                os.fsync(project.fileno())
+            os.chmod(tmp_path, 0o666 & ~UMASK)
+            if current_sha256:
+                self.store_version(relpath, current_sha256)
+            os.replace(tmp_path, project_file_out)
+            tmp_path = None
+            self.storage.commit(relpath, sha256.hexdigest())
+            if self.version_store:
+                self.version_store.record(relpath, sha256.hexdigest(), size, 'published')
+            self.hash_index.set(relpath, sha256.hexdigest())
+            self.project_index.update(relpath, sha256.hexdigest())
+            if summary is not None:
+                self.summary_store.set(sha256.hexdigest(), summary)
+            self.record_change('published', relpath, sha256.hexdigest())
+            UPLOAD_WRITE_DURATION.observe(time.perf_counter() - start, tenant=self.tenant)
+            UPLOAD_BYTES.inc(size, tenant=self.tenant)
+            self.logger.info("Project '%s' successfully saved" % filename)
+        except SizeLimitError:
+            raise
+        except Exception as e:
+            msg = "Unable to write in file %s" % project_file_out
+            self.logger.error(msg)
+            self.logger.debug('Error : "%s"' % str(e))
+            return self.error_result(msg)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
 
+        result = self.success_result("Project '%s' successfully saved" % filename)
+        result['sha256'] = sha256.hexdigest()
+        result['size'] = size
+        return result
+
+    def validation_enabled(self):
+        return str(self.config.get('project_validation_enable', True)).lower() != 'false'
+
+    def version_matches(self, expected_sha256, current_sha256):
+        """Check expected version of a project for optimistic concurrency
+        :param str expected_sha256: Expected SHA-256, '*' for any, None if not checked
+        :param str current_sha256: SHA-256 of current project, None if it does not exist
+        """
+        if expected_sha256 is None:
+            return True
+        if expected_sha256 == '*':
+            return current_sha256 is not None
+        return expected_sha256 == current_sha256
+
+    def conflict_result(self, filename, expected_sha256, current_sha256):
+        if current_sha256 is None:
+            msg = "Project '%s' does not exist, expected version %s" % (filename, expected_sha256)
         else:
+            msg = "Project '%s' has been modified, expected version %s but current version is %s" % (
+                filename, expected_sha256, current_sha256)
+        self.logger.info(msg)
+        result = self.error_result(msg)
+        result['conflict'] = True
+        result['sha256'] = current_sha256
+        return result
+
+    def project_sha256(self, project_path):
+        """Get SHA-256 of project file
+        :param str project_path: Project file path returned by get_project
+        """
+        return self.hash_index.get(os.path.relpath(project_path, self.storage.base_dir))
+
+    def rewind(self, file):
+        """Seek to start of file, return False if file is not seekable
+        :param object file: File-like object
+        """
+        try:
+            file.seek(0)
+            return True
+        except (AttributeError, OSError):
+            # e.g. raw request stream
+            return False
+
+    def unchanged_result(self, filename, sha256, size):
+        self.logger.info("Project '%s' is unchanged" % filename)
+        UPLOAD_UNCHANGED.inc(tenant=self.tenant)
+        result = self.success_result("Project '%s' is unchanged" % filename)
+        result['unchanged'] = True
+        result['sha256'] = sha256
+        result['size'] = size
+        return result
+
+    def publish(self, filename, file, sync=None, expected_sha256=None):
+        """Publish QGIS project
+        :param obj filename: .qgs project file name
+        :param object file: POST request file
+        :param bool sync: Wait for service configurations update
+        :param str expected_sha256: Expected SHA-256 of current project, '*' if it must exist
+        """
+        write_result = self.write_project(filename, file, expected_sha256)
+        return self.published_result(filename, write_result, sync)
+
+    def publish_delta(self, filename, delta, base_sha256, sha256, block_size, sync=None):
+        """Publish QGIS project from a delta against the current project
+        :param str filename: .qgs project file name
+        :param object delta: File-like object with delta instructions
+        :param str base_sha256: SHA-256 of current project the delta is based on
+        :param str sha256: SHA-256 of new project, verified before commit
+        :param int block_size: Block size of delta
+        :param bool sync: Wait for service configurations update
+        """
+        project_file = self.output_path(filename)
+        if not project_file:
             return self.error_result("Project cant not be published. Contact GIS Administrator")
+        if not self.valid_block_size(block_size):
+            return self.error_result("Invalid block size %s" % block_size)
+
+        relpath = os.path.relpath(project_file, self.config.get("qgis_projects_scan_base_dir"))
+        try:
+            project_file = self.storage.fetch(relpath)
+        except OSError:
+            # missing project is reported as conflict with base_sha256
+            project_file = self.storage.path(relpath)
+        reader = DeltaReader(project_file, block_size, delta)
+        try:
+            # copy instructions can expand a small delta to any size
+            write_result = self.write_project(
+                filename, LimitedReader(reader, self.max_decompressed_size()), base_sha256, sha256)
+        finally:
+            reader.close()
+        if reader.error:
+            msg = "Invalid delta: %s" % reader.error
+            self.logger.error("%s : %s" % (msg, filename))
+            return self.error_result(msg)
+        return self.published_result(filename, write_result, sync)
+
+    def published_result(self, filename, write_result, sync):
+        if 'error' in write_result or write_result.get('unchanged'):
+            return write_result
 
-    def delete(self, filename):
+        if self.update_config_enabled():
+            result = self.schedule_config_update(
+                "Project '%s' successfully published" % filename,
+                "Project saved but unable to generate service configurations",
+                "Project '%s' successfully saved, service configurations update scheduled" % filename,
+                sync)
+        else:
+            result = self.success_result("Project '%s' successfully saved but not published, update config is disabled" % filename)
+        result['sha256'] = write_result['sha256']
+        result['size'] = write_result['size']
+        return result
+
+    def project_blocks(self, filename, block_size=None):
+        """Get hashes of fixed-size blocks of current project, for delta uploads
+        :param str filename: .qgs project file name
+        :param int block_size: Block size, delta_block_size if not set
+        """
+        if block_size is None:
+            block_size = int(self.config.get('delta_block_size', 16384))
+        if not self.valid_block_size(block_size):
+            return self.error_result("Invalid block size %s" % block_size)
+        project_file = self.output_path(filename)
+        if not project_file:
+            return self.error_result("Invalid project file name")
+
+        relpath = os.path.relpath(project_file, self.config.get("qgis_projects_scan_base_dir"))
+        with self.locks.project(relpath):
+            sha256 = self.hash_index.get(relpath)
+            if sha256 is None:
+                return self.error_result("Project file does not exist")
+            try:
+                project_file = self.storage.fetch(relpath)
+            except OSError as e:
+                self.logger.debug("Error : %s" % str(e))
+                return self.error_result("Unable to read project file")
+            key = (sha256, block_size)
+            with self.block_hashes_lock:
+                blocks = self.block_hashes_cache.get(key)
+                if blocks is not None:
+                    self.block_hashes_cache.move_to_end(key)
+            if blocks is None:
+                try:
+                    blocks = block_hashes(project_file, block_size)
+                except OSError as e:
+                    self.logger.debug("Error : %s" % str(e))
+                    return self.error_result("Unable to read project file")
+                with self.block_hashes_lock:
+                    self.block_hashes_cache[key] = blocks
+                    while len(self.block_hashes_cache) > 16:
+                        self.block_hashes_cache.popitem(last=False)
+            size = os.path.getsize(project_file)
+
+        return {
+            'filename': filename,
+            'sha256': sha256,
+            'size': size,
+            'block_size': block_size,
+            'blocks': blocks
+        }
+
+    def valid_block_size(self, block_size):
+        return 1024 <= block_size <= 1024 * 1024
+
+    def publish_batch(self, files, allowed_extensions, sync=None):
+        """Publish several QGIS projects with a single service configurations update
+        :param iterable files: (filename, file) tuples, file is None if filename is invalid
+        :param list allowed_extensions: list of allowed extensions
+        :param bool sync: Wait for service configurations update
+        """
+        projects = []
+        saved = 0
+        unchanged = 0
+        for filename, file in files:
+            if file is None:
+                result = self.error_result("Invalid path in archive")
+            elif not filename or not self.allowed_file(filename, allowed_extensions):
+                result = self.error_result("File not allowed")
+            else:
+                result = self.write_project(filename, file)
+                if result.get('unchanged'):
+                    unchanged += 1
+                elif 'success' in result:
+                    saved += 1
+            result['filename'] = filename
+            projects.append(result)
+
+        self.hash_index.flush()
+        if saved == 0 and unchanged > 0:
+            result = self.success_result("%d of %d projects unchanged" % (unchanged, len(projects)))
+            result['unchanged'] = True
+        elif saved == 0:
+            result = self.error_result("No project saved")
+        elif not self.update_config_enabled():
+            result = self.success_result("%d of %d projects saved but not published, update config is disabled" % (saved, len(projects)))
+        else:
+            result = self.schedule_config_update(
+                "%d of %d projects successfully published" % (saved, len(projects)),
+                "Projects saved but unable to generate service configurations",
+                "%d of %d projects successfully saved, service configurations update scheduled" % (saved, len(projects)),
+                sync)
+        result['projects'] = projects
+        return result
+
+    def publish_archive(self, archive, allowed_extensions, prefix='', sync=None):
+        """Publish all QGIS projects of a zip archive
+        :param object archive: Zip archive file-like object
+        :param list allowed_extensions: list of allowed extensions
+        :param str prefix: Relative dir of projects in QWC2 scan dir
+        :param bool sync: Wait for service configurations update
+        """
+        try:
+            zip_file = zipfile.ZipFile(archive)
+        except Exception as e:
+            msg = "Invalid zip archive"
+            self.logger.error(msg)
+            self.logger.debug('Error : "%s"' % str(e))
+            return self.error_result(msg)
+
+        def archive_projects():
+            for info in zip_file.infolist():
+                if info.is_dir():
+                    continue
+                parts = info.filename.replace('\\', '/').split('/')
+                if parts[0] == '' or '..' in parts:
+                    # absolute or parent paths would escape prefix
+                    yield info.filename, None
+                    continue
+                relpath = os.path.join(prefix or '', *[part for part in parts if part not in ['', '.']])
+                with zip_file.open(info) as project:
+                    yield relpath, LimitedReader(project, self.max_decompressed_size())
+
+        with zip_file:
+            return self.publish_batch(archive_projects(), allowed_extensions, sync)
+
+    def delete(self, filename, sync=None, expected_sha256=None):
         """Delete QGIS project file from QWC2 scan dir
         :param str filename: .qgs project file name
+        :param bool sync: Wait for service configurations update
+        :param str expected_sha256: Expected SHA-256 of current project
         """
         project_file = self.output_path(filename)
+        if not project_file:
+            return self.error_result("Project file '%s' does not exist" % filename)
 
-        if not os.path.exists(project_file):
+        relpath = os.path.relpath(project_file, self.config.get("qgis_projects_scan_base_dir"))
+        if not self.storage.exists(relpath):
             return self.error_result("Project file '%s' does not exist" % filename)
 
+        with self.locks.project(relpath):
+            if not self.storage.exists(relpath):
+                # deleted while waiting for lock
+                return self.error_result("Project file '%s' does not exist" % filename)
+            current_sha256 = self.hash_index.get(relpath)
+            if not self.version_matches(expected_sha256, current_sha256):
+                return self.conflict_result(filename, expected_sha256, current_sha256)
+            try:
+                self.store_version(relpath, current_sha256, move=True)
+                self.storage.remove(relpath)
+                self.compression_cache.remove(self.storage.path(relpath))
+                if self.version_store:
+                    self.version_store.record(relpath, None, 0, 'deleted')
+                self.hash_index.remove(relpath)
+                self.project_index.remove(relpath)
+                self.record_change('deleted', relpath)
+            except Exception as e:
+                msg = "Unable to delete file %s" % filename
+                self.logger.error(msg)
+                self.logger.debug("Error : %s" % str(e))
+                return self.error_result(msg)
+
+        return self.schedule_config_update(
+            "Delete completed",
+            "Project deleted but unable to generate service configurations",
+            "Delete completed, service configurations update scheduled",
+            sync)
+
+    def record_change(self, event, relpath, sha256=None):
+        """Append change to change log, without failing the change
+        :param str event: 'published', 'deleted' or 'cleaned'
+        :param str relpath: Project or dir path relative to scan dir
+        :param str sha256: SHA-256 of published project
+        """
         try:
-            os.remove(project_file)
+            self.changelog.append(event, relpath, sha256)
         except Exception as e:
-            msg = "Unable to delete file %s" % project_file
-            self.logger.error(msg)
+            self.logger.warning("Unable to record change of %s" % relpath)
             self.logger.debug("Error : %s" % str(e))
-            return self.error_result(msg)
 
+    def changes(self, since=0, timeout=0, limit=1000):
+        """Get changes after a sequence number, waiting up to timeout seconds
+        for new changes
+        :param int since: Last sequence number seen by client, 0 for all changes
+        :param float timeout: Max wait in seconds
+        :param int limit: Max number of changes returned
+        """
+        if not self.changelog:
+            return self.error_result("qgis_projects_scan_base_dir not defined")
+        changes, truncated = self.changelog.wait(
+            since, max(0, min(timeout, self.changes_max_timeout())), limit)
+        if changes:
+            last_seq = changes[-1]['seq']
+        elif truncated:
+            # client must reload all projects, then resume from current sequence number
+            last_seq = self.changelog.last_seq
+        else:
+            last_seq = since
+        return {'changes': changes, 'last_seq': last_seq, 'truncated': truncated}
+
+    def changes_max_timeout(self):
+        """Max wait in seconds of change requests and duration of change event streams"""
+        return float(self.config.get('changes_max_timeout', 60))
+
+    def store_version(self, relpath, sha256, move=False):
+        """Store current version of a project before it is replaced or deleted,
+        return True if stored
+        :param str relpath: Project path relative to scan dir
+        :param str sha256: SHA-256 of project file
+        :param bool move: Move local project file into version store
+        """
+        if not self.version_store or not sha256:
+            return False
         try:
-            if self.update_config():
-                return self.success_result("Delete completed")
-            else:
-                return self.error_result("Project deleted but unable to generate service configurations")
+            self.version_store.store(relpath, self.storage.fetch(relpath), sha256, move)
+            return True
         except Exception as e:
-            msg = "Unable to generate service configurations"
-            self.logger.error(msg)
-            self.logger.debug('Error : "%s"' % str(e))
-            return self.error_result(msg)
+            self.logger.warning("Unable to store previous version of %s" % relpath)
+            self.logger.debug("Error : %s" % str(e))
+            return False
+
+    def project_versions(self, filename):
+        """Get stored versions of a project, oldest first
+        :param str filename: .qgs project file name
+        """
+        project_file = self.output_path(filename)
+        if not project_file:
+            return self.error_result("Project cant not be found. Contact GIS Administrator")
+        if not self.version_store:
+            return self.error_result("Project versioning is disabled")
+
+        relpath = os.path.relpath(project_file, self.config.get("qgis_projects_scan_base_dir"))
+        current_sha256 = self.hash_index.get(relpath)
+        versions = self.version_store.versions(relpath)
+        for version in versions:
+            version['current'] = version['sha256'] is not None and \
+                version['sha256'] == current_sha256
+        return {'filename': filename, 'versions': versions}
+
+    def rollback(self, filename, sha256, sync=None):
+        """Restore a stored version of a project
+        :param str filename: .qgs project file name
+        :param str sha256: SHA-256 of version to restore
+        :param bool sync: Wait for service configurations update
+        """
+        project_file = self.output_path(filename)
+        if not project_file:
+            return self.error_result("Project cant not be found. Contact GIS Administrator")
+        if not self.version_store:
+            return self.error_result("Project versioning is disabled")
+        if not valid_sha256(sha256):
+            return self.error_result("Invalid version %s" % sha256)
+
+        relpath = os.path.relpath(project_file, self.config.get("qgis_projects_scan_base_dir"))
+        with self.locks.project(relpath):
+            current_sha256 = self.hash_index.get(relpath)
+            if current_sha256 == sha256:
+                result = self.success_result("Version %s of project '%s' is already current" % (sha256, filename))
+                result['unchanged'] = True
+                return result
+
+            if not self.version_store.find_object(sha256):
+                return self.error_result("Version %s of project '%s' not found" % (sha256, filename))
+
+            try:
+                # current project file is linked into the store, then
+                # replaced by a copy of the restored version
+                if current_sha256:
+                    self.version_store.store(relpath, self.storage.fetch(relpath), current_sha256)
+                if not self.version_store.restore(relpath, sha256, self.storage.path(relpath)):
+                    return self.error_result("Version %s of project '%s' not found" % (sha256, filename))
+                self.storage.commit(relpath, sha256)
+                self.hash_index.set(relpath, sha256)
+                self.project_index.update(relpath, sha256)
+                self.record_change('published', relpath, sha256)
+            except Exception as e:
+                msg = "Unable to restore version %s of project %s" % (sha256, filename)
+                self.logger.error(msg)
+                self.logger.debug("Error : %s" % str(e))
+                return self.error_result(msg)
+
+        if self.update_config_enabled():
+            result = self.schedule_config_update(
+                "Project '%s' successfully rolled back" % filename,
+                "Project rolled back but unable to generate service configurations",
+                "Project '%s' successfully rolled back, service configurations update scheduled" % filename,
+                sync)
+        else:
+            result = self.success_result("Project '%s' successfully rolled back but not published, update config is disabled" % filename)
+        result['sha256'] = sha256
+        return result
+
+    def schedule_config_update(self, success_msg, failure_msg, scheduled_msg, sync=None):
+        """Request service configurations update and return result
+        :param str success_msg: Result message if synchronous update succeeded
+        :param str failure_msg: Result message if synchronous update failed
+        :param str scheduled_msg: Result message if update is scheduled
+        :param bool sync: Wait for update, use update_config_sync config if None
+        """
+        if sync is None:
+            sync = str(self.config.get('update_config_sync', False)).lower() == 'true'
+
+        if not sync:
+            job_id = self.config_scheduler.schedule()
+            result = self.success_result(scheduled_msg)
+            result['job_id'] = job_id
+            return result
+
+        job_id = self.config_scheduler.schedule(immediate=True)
+        job = self.config_scheduler.wait(job_id)
+        if job and job['status'] == ConfigGenerationScheduler.SUCCEEDED:
+            result = self.success_result(success_msg)
+        elif job and 'message' in job:
+            result = self.error_result("Unable to generate service configurations")
+        else:
+            result = self.error_result(failure_msg)
+        result['job_id'] = job_id
+        return result
+
+    def config_update_status(self, job_id=None):
+        """Get status of a service configurations update
+        :param str job_id: Job ID returned by publish or delete, latest job if not set
+        """
+        job = self.config_scheduler.status(job_id)
+        if job is None:
+            if job_id:
+                return self.error_result("Unknown job '%s'" % job_id)
+            return self.error_result("No service configurations update requested")
+        job['queue'] = self.config_scheduler.queue_status()
+        return job
 
     def update_config(self):
         """Send request to QWC Config Service to update configurations"""
-        config_generator_url = self.config.get('config_generator_service_url', "http://qwc-config-service:9090")
-
-        response = requests.post(
-            urllib.parse.urljoin(
-                config_generator_url,
-                "generate_configs?tenant=" + self.tenant))
+        try:
+            with CONFIG_UPDATE_DURATION.time(tenant=self.tenant):
+                generated = self.config_generator.generate_configs(self.tenant)
+        except CircuitOpenError:
+            CONFIG_UPDATE_FAILURES.inc(tenant=self.tenant, reason='circuit_open')
+            raise
+        except Exception:
+            CONFIG_UPDATE_FAILURES.inc(tenant=self.tenant, reason='request')
+            raise
 
-        if 'CRITICAL' in response.text:
+        if not generated:
             msg = "Unable to generate service configurations"
             self.logger.error(msg)
+            CONFIG_UPDATE_FAILURES.inc(tenant=self.tenant, reason='critical')
             return False
         else:
             msg = "Service configurations generated"
@@ -134,73 +848,163 @@ class ProjectPublisherService:
             return True
 
     def get_project(self, filename, content_only=False):
-        """Send project file path or content to user request
+        """Get project file path, to be streamed from disk to user request
         :param str filename: .qgs project file name
         :param bool content_only: request download file or only qgis project file content
         """
         project_path = self.output_path(filename)
-        if content_only:
-            if os.path.exists(project_path):
-                with open(project_path, 'rb') as project:
-                    project_content = project.read()
-                    project.close()
-                return project_content
-            else:
-                return
-        else:
-            return project_path
+        if not project_path:
+            return
+        try:
+            project_path = self.storage.fetch(
+                os.path.relpath(project_path, self.config.get("qgis_projects_scan_base_dir")))
+        except OSError:
+            return
+        if not os.path.isfile(project_path):
+            return
+        if content_only and os.path.getsize(project_path) == 0:
+            return
+        return project_path
 
-    def list_projects(self, allowed_extensions):
-        """Get QGIS projects files in QWC2 scan directory
+    def compressed_project(self, project_path, encoding):
+        """Get path of compressed project file, or None if project is not compressed
+        :param str project_path: Project file path returned by get_project
+        :param str encoding: Content encoding (gzip or zstd)
+        """
+        compression_enable = str(self.config.get('compression_enable', True)).lower() != 'false'
+        min_size = int(self.config.get('compression_min_size', 1024))
+        if not compression_enable or not encoding or os.path.getsize(project_path) < min_size:
+            return None
+        return self.compression_cache.get(project_path, encoding)
+
+    def list_projects(self, allowed_extensions, prefix='', offset=0, limit=None, rescan=False,
+                      details=False):
+        """Get QGIS projects files in QWC2 scan directory, from project index
         :param dict allowed_extensions: list of allowed extensions
+        :param str prefix: Only return projects whose relative path starts with prefix
+        :param int offset: Index of first project returned
+        :param int limit: Max number of projects returned
+        :param bool rescan: Force rescan of QWC2 scan directory
+        :param bool details: Return project summaries instead of relative paths
         """
         qgis_projects_scan_base_dir = self.config.get("qgis_projects_scan_base_dir")
-        projects_filenames = []
 
         self.logger.debug("QWC2 scan dir path : %s" % qgis_projects_scan_base_dir)
         if qgis_projects_scan_base_dir:
             if os.path.exists(qgis_projects_scan_base_dir):
-                for dirpath, dirs, files in os.walk(qgis_projects_scan_base_dir,
-                                                    followlinks=True):
-                    for filename in files:
-                        if Path(filename).suffix[1:] in allowed_extensions:
-                            relscanpath = os.path.relpath(dirpath,
-                                                          qgis_projects_scan_base_dir)
-                            if relscanpath == '.':
-                                relscanpath = ''
-                            relprojectpath = os.path.join(relscanpath, filename)
-                            projects_filenames.append(relprojectpath)
+                projects_filenames = self.project_index.list(
+                    allowed_extensions, prefix or '', rescan)
             else:
                 return self.error_result("qgis_projects_scan_base_dir is defined but not exists")
         else:
             return self.error_result("qgis_projects_scan_base_dir not defined")
 
+        total = len(projects_filenames)
+        if limit is not None:
+            projects_filenames = projects_filenames[offset:offset + limit]
+        elif offset:
+            projects_filenames = projects_filenames[offset:]
+
         self.logger.debug('Projects in %s : %s ' % (qgis_projects_scan_base_dir, projects_filenames))
 
-        return projects_filenames
+        if details:
+            projects_filenames = [self.project_details(relpath) for relpath in projects_filenames]
+            self.hash_index.flush()
 
-    def clean_empty_dirs(self):
+        return {'projects': projects_filenames, 'total': total}
+
+    def project_details(self, relpath):
+        """Get summary of a project, parsed only if it was not published by this service
+        :param str relpath: Project path relative to scan dir
+        """
+        details = {'path': relpath}
+        sha256 = self.hash_index.get(relpath)
+        if sha256 is None:
+            details['error'] = "Project file does not exist"
+            return details
+        details['sha256'] = sha256
+        try:
+            details.update(self.summary_store.summarize(self.storage.fetch(relpath), sha256))
+        except OSError as e:
+            self.logger.debug("Error : %s" % str(e))
+            details['error'] = "Unable to read project file"
+        return details
+
+    def clean_empty_dirs(self, dry_run=False, background=False):
+        """Delete empty directories trees in QWC2 scan directory
+        :param bool dry_run: Only report directories to delete
+        :param bool background: Run in background thread and return a job ID
+        """
         qgis_projects_scan_base_dir = self.config.get("qgis_projects_scan_base_dir")
-        deleted_dirs = []
         if qgis_projects_scan_base_dir:
-            for dirpath, dirs, files in os.walk(qgis_projects_scan_base_dir, topdown=False):
-                for dir in dirs:
-                    fulldirpath = os.path.join(dirpath, dir)
-                    reldirpath = os.path.relpath(fulldirpath, qgis_projects_scan_base_dir)
-                    if len(os.listdir(fulldirpath)) == 0:
-                        try:
-                            os.rmdir(fulldirpath)
-                            deleted_dirs.append(reldirpath)
-                        except Exception as e:
-                            if deleted_dirs:
-                                msg_deleted_dirs = " but some directories are deleted : %s" % str(deleted_dirs)
-                            else:
-                                msg_deleted_dirs = ""
-                            msg = "Unable to delete directory %s%s" % (fulldirpath, msg_deleted_dirs)
-                            self.logger.error(msg)
-                            self.logger.debug("Error : %s" % str(e))
-                            return self.error_result(msg)
-
-            return self.success_result("Directories deleted : %s" % str(deleted_dirs))
+            cleaner = EmptyDirCleaner(
+                qgis_projects_scan_base_dir, self.logger,
+                int(self.config.get('clean_workers', 1)), dry_run, self.locks)
+
+            if background:
+                job_id = str(uuid.uuid4())
+                with self.clean_jobs_lock:
+                    self.clean_jobs[job_id] = {'cleaner': cleaner, 'result': None}
+                    while len(self.clean_jobs) > 100:
+                        self.clean_jobs.popitem(last=False)
+                threading.Thread(
+                    target=self.run_clean_job, args=(job_id, cleaner), daemon=True).start()
+                result = self.success_result("Directories cleaning started")
+                result['job_id'] = job_id
+                return result
+
+            return self.clean_result(self.run_cleaner(cleaner))
         else:
             return self.error_result("qgis_projects_scan_base_dir not defined")
+
+    def run_clean_job(self, job_id, cleaner):
+        try:
+            result = self.clean_result(self.run_cleaner(cleaner))
+        except Exception as e:
+            msg = "Unable to clean directories"
+            self.logger.error(msg)
+            self.logger.debug("Error : %s" % str(e))
+            result = self.error_result(msg)
+        with self.clean_jobs_lock:
+            if job_id in self.clean_jobs:
+                self.clean_jobs[job_id]['result'] = result
+
+    def run_cleaner(self, cleaner):
+        cleaner.run()
+        if not cleaner.dry_run:
+            for path in cleaner.deleted:
+                self.record_change('cleaned', path)
+        return cleaner
+
+    def clean_result(self, cleaner):
+        if cleaner.dry_run:
+            msg = "Directories to delete : %s" % str(cleaner.deleted)
+        else:
+            msg = "Directories deleted : %s" % str(cleaner.deleted)
+
+        if cleaner.errors:
+            result = self.error_result("Unable to delete directories %s" % str(sorted(cleaner.errors)))
+            result['details'] = msg
+            result['errors'] = cleaner.errors
+        else:
+            result = self.success_result(msg)
+        result['deleted'] = cleaner.deleted
+        return result
+
+    def clean_status(self, job_id):
+        """Get progress or result of a background directories cleaning
+        :param str job_id: Job ID returned by clean_empty_dirs
+        """
+        with self.clean_jobs_lock:
+            job = self.clean_jobs.get(job_id)
+        if job is None:
+            return self.error_result("Unknown job '%s'" % job_id)
+
+        if job['result'] is None:
+            status = {'status': 'running'}
+        else:
+            status = dict(job['result'])
+            status['status'] = 'finished'
+        status['job_id'] = job_id
+        status['progress'] = job['cleaner'].progress()
+        return status
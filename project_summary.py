@@ -0,0 +1,173 @@
+import json
+import os
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+
+class ProjectValidator:
+    """ProjectValidator class
+    Incremental XML parser of a QGIS project, fed with chunks while the
+    project is streamed to disk. Parsed elements are dropped as soon as they
+    are closed, so memory use does not depend on project size.
+    Extracts a summary with title, CRS, layer count and datasource types.
+    """
+
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.stack = []
+        self.error = None
+        self.summary = {
+            'title': None,
+            'version': None,
+            'crs': None,
+            'layers': 0,
+            'datasources': {}
+        }
+
+    def feed(self, chunk):
+        """Parse next chunk, return False once content is invalid
+        :param bytes chunk: Project content
+        """
+        if self.error is not None:
+            return False
+        try:
+            self.parser.feed(chunk)
+            self.read_events()
+        except ET.ParseError as e:
+            self.error = "Invalid XML: %s" % str(e)
+        return self.error is None
+
+    def close(self):
+        """Finish parsing, return summary or None if content is invalid"""
+        if self.error is None:
+            try:
+                self.parser.close()
+                self.read_events()
+            except ET.ParseError as e:
+                self.error = "Invalid XML: %s" % str(e)
+        if self.error is None and self.summary['version'] is None:
+            self.error = "Not a QGIS project"
+        if self.error is not None:
+            return None
+        return self.summary
+
+    def read_events(self):
+        for event, elem in self.parser.read_events():
+            if event == 'start':
+                if not self.stack:
+                    if elem.tag != 'qgis':
+                        raise ET.ParseError("root element is <%s>, not <qgis>" % elem.tag)
+                    self.summary['version'] = elem.get('version', '')
+                    self.summary['title'] = elem.get('projectname') or None
+                self.stack.append(elem)
+                continue
+
+            path = [e.tag for e in self.stack]
+            if path == ['qgis', 'title'] and elem.text:
+                self.summary['title'] = elem.text
+            elif path == ['qgis', 'projectCrs', 'spatialrefsys', 'authid']:
+                self.summary['crs'] = elem.text
+            elif path == ['qgis', 'projectlayers', 'maplayer', 'provider']:
+                provider = elem.text or 'unknown'
+                datasources = self.summary['datasources']
+                datasources[provider] = datasources.get(provider, 0) + 1
+            elif path == ['qgis', 'projectlayers', 'maplayer']:
+                self.summary['layers'] += 1
+
+            self.stack.pop()
+            if self.stack:
+                # drop closed element
+                self.stack[-1].remove(elem)
+
+
+class SummaryStore:
+    """SummaryStore class
+    Project summaries, stored once per SHA-256 of project content as JSON
+    files, with an in-memory LRU cache. Entries never change, so they are
+    shared by all worker processes without locking.
+    """
+
+    def __init__(self, store_dir, logger, cache_size=10000, chunk_size=1024 * 1024):
+        """Constructor
+        :param str store_dir: Store dir
+        :param Logger logger: Application logger
+        :param int cache_size: Max number of cached summaries
+        :param int chunk_size: Read size when parsing projects
+        """
+        self.store_dir = store_dir
+        self.logger = logger
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def path(self, sha256):
+        return os.path.join(self.store_dir, sha256[:2], sha256 + '.json')
+
+    def get(self, sha256):
+        """Return summary of project content, or None if not stored
+        :param str sha256: SHA-256 of project content
+        """
+        with self.lock:
+            summary = self.cache.get(sha256)
+            if summary is not None:
+                self.cache.move_to_end(sha256)
+                return summary
+        try:
+            with open(self.path(sha256), encoding='utf-8') as fh:
+                summary = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        self.cache_summary(sha256, summary)
+        return summary
+
+    def set(self, sha256, summary):
+        """Store summary of project content
+        :param str sha256: SHA-256 of project content
+        :param dict summary: Project summary
+        """
+        self.cache_summary(sha256, summary)
+        path = self.path(sha256)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+                json.dump(summary, fh)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.warning("Could not store project summary '%s'" % path)
+            self.logger.debug("Error : %s" % str(e))
+
+    def cache_summary(self, sha256, summary):
+        if self.cache_size <= 0:
+            return
+        with self.lock:
+            self.cache[sha256] = summary
+            self.cache.move_to_end(sha256)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def summarize(self, path, sha256):
+        """Return summary of a project file, parsed only if not stored
+        :param str path: Project file path
+        :param str sha256: SHA-256 of project file
+        """
+        summary = self.get(sha256)
+        if summary is not None:
+            return summary
+
+        validator = ProjectValidator()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(self.chunk_size), b''):
+                if not validator.feed(chunk):
+                    break
+        summary = validator.close()
+        if summary is None:
+            summary = {'error': validator.error}
+        self.set(sha256, summary)
+        return summary
@@ -0,0 +1,68 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+class TokenBucket:
+    """TokenBucket class
+    Rate limiter allowing bursts of up to burst requests, refilled with
+    rate tokens per second.
+
+    With a state file, the bucket is shared by all worker processes, and
+    updated under a file lock.
+    """
+
+    def __init__(self, rate, burst, state_path=None):
+        """Constructor
+        :param float rate: Allowed requests per second
+        :param float burst: Max number of requests allowed at once
+        :param str state_path: File of bucket shared by all processes
+        """
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.state_path = state_path
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, return 0 if allowed, else seconds until a token is available"""
+        with self.lock:
+            if not self.state_path:
+                return self.take()
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(self.state_path + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    self.load()
+                    retry_after = self.take()
+                    self.save()
+                    return retry_after
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def take(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + max(0, now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def load(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as fh:
+                state = json.load(fh)
+            self.tokens = state['tokens']
+            self.updated = state['updated']
+        except (OSError, ValueError, KeyError):
+            # new bucket
+            self.tokens = self.burst
+            self.updated = time.time()
+
+    def save(self):
+        with open(self.state_path, 'w', encoding='utf-8') as fh:
+            json.dump({'tokens': self.tokens, 'updated': self.updated}, fh)
@@ -1,18 +1,29 @@
+import json
 import logging
+import math
 import os
+import tempfile
+import threading
+import time
 
-from flask import Flask, Response, jsonify, request, send_file
+from flask import Flask, Response, g, jsonify, request, send_file, stream_with_context
 from flask_restx import Api, Resource, reqparse
 from werkzeug.datastructures import FileStorage
 
 from qwc_services_core.auth import auth_manager, optional_auth, get_identity, get_groups, get_username
 from qwc_services_core.api import CaseInsensitiveArgument
-from qwc_services_core.tenant_handler import TenantHandler
+from qwc_services_core.tenant_handler import TenantHandlerBase
+from compression import decompress_stream, negotiate_encoding
+from config_scheduler import ConfigGenerationQueue
+from metrics import REGISTRY, REQUESTS, REQUEST_DURATION
 from project_publisher_service import ProjectPublisherService
 from access_control import AccessControl
+from tenant_config import TenantConfigCache
 
 AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', '0').lower() not in [0, "0", "false"]
 ALLOWED_EXTENSIONS = ['qgs']
+# endpoints without access control (probes and metrics)
+PUBLIC_ENDPOINTS = ['ready', 'healthz', 'metrics']
 
 # Flask application
 app = Flask(__name__)
@@ -28,17 +39,32 @@ jwt = auth_manager(app, api)
 
 
 # create tenant handler
-tenant_handler = TenantHandler(app.logger)
+tenant_handler = TenantHandlerBase()
+# tenant configs and handlers, shared by publisher and access control
+tenant_config_cache = TenantConfigCache('projectPublisher', app.logger)
+# config generations of all tenants, run in turn
+config_generation_queue = ConfigGenerationQueue(
+    int(os.environ.get('CONFIG_GENERATION_WORKERS', 2)),
+    int(os.environ.get('CONFIG_GENERATION_QUEUE_SIZE', 100)),
+    os.environ.get('CONFIG_GENERATION_LOCK_DIR', os.path.join(
+        tempfile.gettempdir(), 'qwc-project-publisher', 'config-generation')))
+# Server-Sent Events streams of /changes, each holding a worker thread
+change_streams = threading.BoundedSemaphore(int(os.environ.get('CHANGES_MAX_STREAMS', 8)))
 
 
 def project_publisher_service_handler():
     """Get or create a Project Publisher Service instance for a tenant."""
-    tenant = tenant_handler.tenant()
-    handler = tenant_handler.handler('projectPublisher', 'publisher', tenant)
-    if handler is None:
-        handler = tenant_handler.register_handler(
-            'publisher', tenant, ProjectPublisherService(tenant, app.logger))
-    return handler
+    return tenant_config_cache.handler(
+        'publisher', tenant_handler.tenant(),
+        lambda tenant, config: ProjectPublisherService(
+            tenant, app.logger, config, config_generation_queue))
+
+
+def access_control_handler():
+    """Get or create an Access Control instance for a tenant."""
+    return tenant_config_cache.handler(
+        'access_control', tenant_handler.tenant(),
+        lambda tenant, config: AccessControl(tenant, app.logger, config))
 
 
 def check_filename(api, params):
@@ -48,6 +74,37 @@ def check_filename(api, params):
         api.abort(404, "filename parameter is required")
 
 
+def optional_bool(value):
+    if value is None:
+        return None
+    return value.lower() in ["true", "1"]
+
+
+def expected_sha256(params):
+    """Expected SHA-256 of current project for optimistic concurrency,
+    from expected_sha256 parameter or If-Match header"""
+    if params.get('expected_sha256'):
+        return params['expected_sha256']
+    if request.if_match.star_tag:
+        return '*'
+    for etag in request.if_match.as_set():
+        # ETag of compressed projects is "<sha256>-<encoding>"
+        return etag.split('-')[0]
+    return None
+
+
+def result_response(result):
+    """JSON response of a service result, with status 409 on conflict
+    and 429 if the request is rejected by a tenant limit"""
+    response = jsonify(result)
+    if result.get('conflict'):
+        response.status_code = 409
+    elif 'retry_after' in result:
+        response.status_code = 429
+        response.headers['Retry-After'] = str(int(math.ceil(result['retry_after'])))
+    return response
+
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -56,7 +113,26 @@ def allowed_file(filename):
 # request parser
 publish_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
 publish_parser.add_argument('filename', type=str)
-publish_parser.add_argument('file', location='files', type=FileStorage, required=True)
+publish_parser.add_argument('file', location='files', type=FileStorage)
+publish_parser.add_argument('sync', type=str)
+publish_parser.add_argument('expected_sha256', type=str)
+
+blocks_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+blocks_parser.add_argument('filename', required=True, type=str)
+blocks_parser.add_argument('block_size', type=int)
+
+delta_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+delta_parser.add_argument('filename', required=True, type=str)
+delta_parser.add_argument('base_sha256', required=True, type=str)
+delta_parser.add_argument('sha256', required=True, type=str)
+delta_parser.add_argument('block_size', required=True, type=int)
+delta_parser.add_argument('sync', type=str)
+
+publish_batch_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+publish_batch_parser.add_argument('file', location='files', type=FileStorage, action='append')
+publish_batch_parser.add_argument('archive', location='files', type=FileStorage)
+publish_batch_parser.add_argument('prefix', type=str)
+publish_batch_parser.add_argument('sync', type=str)
 
 get_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
 get_parser.add_argument('filename', required=True, type=str)
@@ -64,11 +140,63 @@ get_parser.add_argument('content_only', default="true", type=str)
 
 delete_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
 delete_parser.add_argument('filename', required=True, type=str)
+delete_parser.add_argument('sync', type=str)
+delete_parser.add_argument('expected_sha256', type=str)
+
+versions_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+versions_parser.add_argument('filename', required=True, type=str)
+
+rollback_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+rollback_parser.add_argument('filename', required=True, type=str)
+rollback_parser.add_argument('sha256', required=True, type=str)
+rollback_parser.add_argument('sync', type=str)
+
+changes_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+changes_parser.add_argument('since', type=int)
+changes_parser.add_argument('timeout', type=float)
+changes_parser.add_argument('limit', type=int)
+
+list_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+list_parser.add_argument('prefix', type=str)
+list_parser.add_argument('offset', type=int)
+list_parser.add_argument('limit', type=int)
+list_parser.add_argument('rescan', type=str)
+list_parser.add_argument('details', type=str)
+
+clean_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+clean_parser.add_argument('dry_run', type=str)
+clean_parser.add_argument('background', type=str)
+
+clean_status_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+clean_status_parser.add_argument('job_id', required=True, type=str)
+
+status_parser = reqparse.RequestParser(argument_class=CaseInsensitiveArgument)
+status_parser.add_argument('job_id', type=str)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unknown'
+        tenant = tenant_handler.tenant()
+        REQUESTS.inc(route=route, method=request.method, status=response.status_code, tenant=tenant)
+        REQUEST_DURATION.observe(
+            time.perf_counter() - start, route=route, method=request.method, tenant=tenant)
+    return response
 
 
 @app.before_request
 @optional_auth
 def assert_user_is_logged():
+    if request.endpoint in PUBLIC_ENDPOINTS:
+        return
+
     app.logger.debug("AUTH_REQUIRED : %s" % AUTH_REQUIRED)
     identity = get_identity()
     username = get_username(identity)
@@ -82,7 +210,7 @@ def assert_user_is_logged():
             app.logger.info(msg)
             api.abort(401, msg)
 
-        access_control = AccessControl(tenant_handler.tenant(), app.logger)
+        access_control = access_control_handler()
         if not access_control.is_publisher(identity):
             msg = "Access denied for user %s. The user us not a member of publisher group." % username
             app.logger.info(msg)
@@ -93,46 +221,188 @@ def assert_user_is_logged():
 class PublishProject(Resource):
     @api.doc('publishproject')
     @api.param('filename', 'Relative project path in qgis_projects_scan_base_dir folder')
-    @api.param('file', 'QGIS Project data (with .qgs extension)')
+    @api.param('file', 'QGIS Project data (with .qgs extension), or raw request body if filename is set')
+    @api.param('sync', 'Wait for service configurations update before returning')
+    @api.param('expected_sha256', 'Only publish if current project has this SHA-256 (or If-Match header), else return 409')
     @api.expect(publish_parser)
     @optional_auth
     def post(self):
         '''Publish a QGIS project, in QWC Scan path of current tenant'''
-        # check if the post request has the file part
-        if 'file' not in request.files:
-            api.abort(404, "No file part")
-        file = request.files['file']
-        # If the user does not select a file, the browser submits an
-        # empty file without a filename.
-        if file.filename == '':
-            api.abort(404, "No selected file")
-        if not file or not allowed_file(file.filename):
-            api.abort(404, "File not allowed")
-
+        publish_service = project_publisher_service_handler()
+        rejected = publish_service.throttle()
+        if rejected:
+            return result_response(rejected)
+        with publish_service.upload_slot() as rejected:
+            if rejected:
+                return result_response(rejected)
+            return self.publish(publish_service)
+
+    def publish(self, publish_service):
         params = publish_parser.parse_args()
 
-        publish_service = project_publisher_service_handler()
+        if request.mimetype != 'multipart/form-data' and params.get('filename'):
+            # raw project data in request body, streamed without multipart parsing
+            if not allowed_file(params['filename']):
+                api.abort(404, "File not allowed")
+            file = request.stream
+            content_encoding = request.headers.get('Content-Encoding')
+        else:
+            # check if the post request has the file part
+            if 'file' not in request.files:
+                api.abort(404, "No file part")
+            file = request.files['file']
+            # If the user does not select a file, the browser submits an
+            # empty file without a filename.
+            if file.filename == '':
+                api.abort(404, "No selected file")
+            if not file or not allowed_file(file.filename):
+                api.abort(404, "File not allowed")
+            content_encoding = file.headers.get('Content-Encoding')
+
+        file_name = file.filename if isinstance(file, FileStorage) else None
+        file = decompress_stream(file, content_encoding, publish_service.max_decompressed_size())
+        if file is None:
+            api.abort(415, "Unsupported Content-Encoding %s" % content_encoding)
+
         tenant = publish_service.tenant
 
         if 'filename' in params and params['filename']:
             filename = params['filename']
         else:
-            filename = file.filename
+            filename = file_name
 
         identity = get_identity()
         username = get_username(identity)
-        result = publish_service.publish(filename, file)
+        result = publish_service.publish(
+            filename, file, optional_bool(params.get('sync')), expected_sha256(params))
 
         app.logger.debug('Publish result : "%s' % result)
         app.logger.info('User %s publish project %s in tenant %s' % (username, filename, tenant))
 
+        return result_response(result)
+
+
+@api.route('/projectblocks')
+class ProjectBlocks(Resource):
+    @api.doc('projectblocks')
+    @api.param('filename', 'Relative project path in qgis_projects_scan_base_dir folder')
+    @api.param('block_size', 'Block size in bytes, between 1024 and 1048576')
+    @api.expect(blocks_parser)
+    @optional_auth
+    def get(self):
+        '''Get block hashes of specific QGIS project, for delta uploads to /publishdelta'''
+        params = blocks_parser.parse_args()
+
+        # Check 'filename' parameter
+        check_filename(api, params)
+
+        publish_service = project_publisher_service_handler()
+        result = publish_service.project_blocks(params['filename'], params.get('block_size'))
+
         return jsonify(result)
 
 
+@api.route('/publishdelta')
+class PublishDelta(Resource):
+    @api.doc('publishdelta')
+    @api.param('filename', 'Relative project path in qgis_projects_scan_base_dir folder')
+    @api.param('base_sha256', 'SHA-256 of current project, as returned by /projectblocks, else return 409')
+    @api.param('sha256', 'SHA-256 of new project, verified before it is saved')
+    @api.param('block_size', 'Block size of /projectblocks hashes the delta refers to')
+    @api.param('sync', 'Wait for service configurations update before returning')
+    @api.expect(delta_parser)
+    @optional_auth
+    def post(self):
+        '''Publish a QGIS project from a delta against the current project, in request body'''
+        publish_service = project_publisher_service_handler()
+        rejected = publish_service.throttle()
+        if rejected:
+            return result_response(rejected)
+        with publish_service.upload_slot() as rejected:
+            if rejected:
+                return result_response(rejected)
+            return self.publish(publish_service)
+
+    def publish(self, publish_service):
+        params = delta_parser.parse_args()
+
+        filename = params['filename']
+        if not allowed_file(filename):
+            api.abort(404, "File not allowed")
+
+        content_encoding = request.headers.get('Content-Encoding')
+        delta = decompress_stream(
+            request.stream, content_encoding, publish_service.max_decompressed_size())
+        if delta is None:
+            api.abort(415, "Unsupported Content-Encoding %s" % content_encoding)
+
+        identity = get_identity()
+        username = get_username(identity)
+        result = publish_service.publish_delta(
+            filename, delta, params['base_sha256'], params['sha256'], params['block_size'],
+            optional_bool(params.get('sync')))
+
+        app.logger.debug('Publish delta result : "%s' % result)
+        app.logger.info('User %s publish delta of project %s in tenant %s' % (
+            username, filename, publish_service.tenant))
+
+        return result_response(result)
+
+
+@api.route('/publishbatch')
+class PublishBatch(Resource):
+    @api.doc('publishbatch')
+    @api.param('file', 'QGIS Projects data (with .qgs extension), may be repeated')
+    @api.param('archive', 'Zip archive of QGIS projects')
+    @api.param('prefix', 'Relative dir of projects in qgis_projects_scan_base_dir folder')
+    @api.param('sync', 'Wait for service configurations update before returning')
+    @api.expect(publish_batch_parser)
+    @optional_auth
+    def post(self):
+        '''Publish several QGIS projects, in QWC Scan path of current tenant, with a single configurations update'''
+        publish_service = project_publisher_service_handler()
+        rejected = publish_service.throttle()
+        if rejected:
+            return result_response(rejected)
+        with publish_service.upload_slot() as rejected:
+            if rejected:
+                return result_response(rejected)
+            return self.publish_batch(publish_service)
+
+    def publish_batch(self, publish_service):
+        files = request.files.getlist('file')
+        archive = request.files.get('archive')
+        if not files and not archive:
+            api.abort(404, "No file part")
+
+        params = publish_batch_parser.parse_args()
+        prefix = params.get('prefix') or ''
+        sync = optional_bool(params.get('sync'))
+
+        tenant = publish_service.tenant
+
+        identity = get_identity()
+        username = get_username(identity)
+        if archive:
+            result = publish_service.publish_archive(archive, ALLOWED_EXTENSIONS, prefix, sync)
+        else:
+            result = publish_service.publish_batch(
+                [(os.path.join(prefix, file.filename), file) for file in files],
+                ALLOWED_EXTENSIONS, sync)
+
+        app.logger.debug('Publish batch result : "%s"' % result)
+        app.logger.info('User %s publish %d projects in tenant %s' % (
+            username, len(result.get('projects', [])), tenant))
+
+        return result_response(result)
+
+
 @api.route('/deleteproject')
 class DeleteProject(Resource):
     @api.doc('deleteproject')
     @api.param('filename', 'Relative project path in qgis_projects_scan_base_dir folder')
+    @api.param('sync', 'Wait for service configurations update before returning')
+    @api.param('expected_sha256', 'Only delete if current project has this SHA-256 (or If-Match header), else return 409')
     @api.expect(delete_parser)
     @optional_auth
     def delete(self):
@@ -143,17 +413,21 @@ class DeleteProject(Resource):
         check_filename(api, params)
 
         publish_service = project_publisher_service_handler()
+        rejected = publish_service.throttle()
+        if rejected:
+            return result_response(rejected)
         tenant = publish_service.tenant
         filename = params['filename']
 
         identity = get_identity()
         username = get_username(identity)
 
-        result = publish_service.delete(filename)
+        result = publish_service.delete(
+            filename, optional_bool(params.get('sync')), expected_sha256(params))
         app.logger.debug('Delete result : "%s"' % result)
         if 'success' in result:
             app.logger.info('User %s delete project %s in tenant %s' % (username, filename, tenant))
-        return jsonify(result)
+        return result_response(result)
 
 @api.route('/getproject')
 class GetProject(Resource):
@@ -179,52 +453,274 @@ class GetProject(Resource):
 
         app.logger.debug('Download result : "%s' % result)
         if result:
+            encoding = negotiate_encoding(request.accept_encodings)
+            compressed = publish_service.compressed_project(result, encoding)
+            # ETag is the project SHA-256, to be sent back in If-Match header
+            etag = publish_service.project_sha256(result) or True
+            if compressed and etag is not True:
+                etag = '%s-%s' % (etag, encoding)
+            # send_file streams from disk (sendfile if supported by WSGI server)
+            # and handles ETag, If-None-Match, If-Modified-Since and Range
             if content_only:
                 app.logger.info('User %s download content of project %s in tenant %s' % (username, filename, tenant))
-                return Response(result, mimetype='text/xml')
+                response = send_file(
+                    compressed or result, mimetype='text/xml', conditional=True,
+                    etag=etag, download_name=os.path.basename(result))
             else:
                 app.logger.info('User %s download project file %s in tenant %s' % (username, filename, tenant))
-                return send_file(result, as_attachment=True)
+                response = send_file(
+                    compressed or result, mimetype='text/xml', as_attachment=True,
+                    conditional=True, etag=etag, download_name=os.path.basename(result))
+            if compressed:
+                response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
         else:
             msg = "Project file %s empty or does not exist" % filename
             app.logger.debug(msg)
             api.abort(404, msg)
 
+@api.route('/projectversions')
+class ProjectVersions(Resource):
+    @api.doc('projectversions')
+    @api.param('filename', 'Relative project path in qgis_projects_scan_base_dir folder')
+    @api.expect(versions_parser)
+    @optional_auth
+    def get(self):
+        '''List stored versions of specific QGIS project, in QWC Scan path of current tenant'''
+        params = versions_parser.parse_args()
+
+        # Check 'filename' parameter
+        check_filename(api, params)
+
+        publish_service = project_publisher_service_handler()
+        result = publish_service.project_versions(params['filename'])
+
+        return jsonify(result)
+
+
+@api.route('/rollback')
+class RollbackProject(Resource):
+    @api.doc('rollback')
+    @api.param('filename', 'Relative project path in qgis_projects_scan_base_dir folder')
+    @api.param('sha256', 'SHA-256 of version to restore, as listed by /projectversions')
+    @api.param('sync', 'Wait for service configurations update before returning')
+    @api.expect(rollback_parser)
+    @optional_auth
+    def post(self):
+        '''Restore a stored version of specific QGIS project, in QWC Scan path of current tenant'''
+        params = rollback_parser.parse_args()
+
+        # Check 'filename' parameter
+        check_filename(api, params)
+        filename = params['filename']
+        if not allowed_file(filename):
+            api.abort(404, "File not allowed")
+
+        publish_service = project_publisher_service_handler()
+        rejected = publish_service.throttle()
+        if rejected:
+            return result_response(rejected)
+        tenant = publish_service.tenant
+
+        identity = get_identity()
+        username = get_username(identity)
+
+        result = publish_service.rollback(filename, params['sha256'], optional_bool(params.get('sync')))
+        app.logger.debug('Rollback result : "%s"' % result)
+        if 'success' in result:
+            app.logger.info('User %s roll back project %s to %s in tenant %s' % (
+                username, filename, params['sha256'], tenant))
+        return result_response(result)
+
+
 @api.route('/listprojects')
 class ListProjects(Resource):
     @api.doc('listprojects')
+    @api.param('prefix', 'Only list projects whose relative path starts with prefix')
+    @api.param('offset', 'Index of first listed project')
+    @api.param('limit', 'Max number of listed projects')
+    @api.param('rescan', 'Rescan QWC Scan path instead of using project index')
+    @api.param('details', 'List project summaries (title, CRS, layer count, datasource types) instead of paths')
+    @api.expect(list_parser)
     @optional_auth
     def get(self):
         '''List all QGIS projects, with their relative path, in QWC Scan path of current tenant'''
+        params = list_parser.parse_args()
+
         publish_service = project_publisher_service_handler()
         tenant = publish_service.tenant
         identity = get_identity()
         username = get_username(identity)
 
-        result = publish_service.list_projects(ALLOWED_EXTENSIONS)
+        result = publish_service.list_projects(
+            ALLOWED_EXTENSIONS, params.get('prefix'), params.get('offset') or 0,
+            params.get('limit'), optional_bool(params.get('rescan')),
+            optional_bool(params.get('details')))
 
         app.logger.info('User %s list projects in tenant %s' % (username, tenant))
         app.logger.debug(result)
+        if 'error' in result:
+            return jsonify(result)
+
+        response = jsonify(result['projects'])
+        response.headers['X-Total-Count'] = result['total']
+        response.add_etag()
+        return response.make_conditional(request)
+
+
+@api.route('/changes')
+class Changes(Resource):
+    @api.doc('changes')
+    @api.param('since', 'Last sequence number seen, only return later changes (Last-Event-ID header takes precedence)')
+    @api.param('timeout', 'Wait up to timeout seconds for changes (long-poll)')
+    @api.param('limit', 'Max number of returned changes')
+    @api.expect(changes_parser)
+    @optional_auth
+    def get(self):
+        '''List changes of QGIS projects in QWC Scan path of current tenant, as JSON
+        or as Server-Sent Events if text/event-stream is accepted'''
+        params = changes_parser.parse_args()
+
+        # reconnecting event streams resume from Last-Event-ID
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id:
+            try:
+                since = int(last_event_id)
+            except ValueError:
+                api.abort(400, "Invalid Last-Event-ID %s" % last_event_id)
+        else:
+            since = params.get('since') or 0
+        limit = params.get('limit') or 1000
+
+        publish_service = project_publisher_service_handler()
+        if request.accept_mimetypes.best == 'text/event-stream':
+            if not change_streams.acquire(blocking=False):
+                app.logger.warning("Too many change event streams")
+                return result_response({
+                    'error': "Too many change event streams", 'retry_after': 5
+                })
+            response = Response(
+                stream_with_context(change_events(publish_service, since, limit)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            # also released if the stream is closed before it started
+            response.call_on_close(change_streams.release)
+            return response
+
+        result = publish_service.changes(since, params.get('timeout') or 0, limit)
         return jsonify(result)
 
+
+def change_events(publish_service, since, limit):
+    """Yield changes as Server-Sent Events, with keepalive comments, until
+    changes_max_timeout has elapsed. Clients reconnect with Last-Event-ID."""
+    deadline = time.monotonic() + publish_service.changes_max_timeout()
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        result = publish_service.changes(since, min(15, remaining), limit)
+        if 'error' in result:
+            yield 'event: error\ndata: %s\n\n' % json.dumps(result)
+            return
+        if result['truncated']:
+            # client must reload all projects
+            yield 'id: %d\nevent: truncated\ndata: %s\n\n' % (
+                result['last_seq'], json.dumps({'last_seq': result['last_seq']}))
+        elif not result['changes']:
+            yield ': keepalive\n\n'
+        for change in result['changes']:
+            yield 'id: %d\nevent: %s\ndata: %s\n\n' % (
+                change['seq'], change['event'], json.dumps(change))
+        since = result['last_seq']
+
+
 @api.route('/clean')
-class ListProjects(Resource):
+class CleanDirs(Resource):
     @api.doc('clean')
+    @api.param('dry_run', 'Only list directories to delete')
+    @api.param('background', 'Run in background, get progress with /cleanstatus')
+    @api.expect(clean_parser)
     @optional_auth
     def get(self):
         '''Delete empty directories in QWC Scan path of current tenant'''
+        params = clean_parser.parse_args()
+
         publish_service = project_publisher_service_handler()
         tenant = publish_service.tenant
         identity = get_identity()
         username = get_username(identity)
 
-        result = publish_service.clean_empty_dirs()
+        result = publish_service.clean_empty_dirs(
+            optional_bool(params.get('dry_run')) or False,
+            optional_bool(params.get('background')) or False)
 
         app.logger.info('User %s clean empty directories in tenant %s' % (username, tenant))
 
         return jsonify(result)
 
 
+@api.route('/cleanstatus')
+class CleanStatus(Resource):
+    @api.doc('cleanstatus')
+    @api.param('job_id', 'Job ID returned by /clean')
+    @api.expect(clean_status_parser)
+    @optional_auth
+    def get(self):
+        '''Get progress or result of a background cleaning of empty directories of current tenant'''
+        params = clean_status_parser.parse_args()
+
+        publish_service = project_publisher_service_handler()
+        result = publish_service.clean_status(params['job_id'])
+
+        if 'error' in result and 'job_id' not in result:
+            api.abort(404, result['error'])
+        return jsonify(result)
+
+
+@api.route('/configstatus')
+class ConfigStatus(Resource):
+    @api.doc('configstatus')
+    @api.param('job_id', 'Job ID returned by publish or delete (latest job if not set)')
+    @api.expect(status_parser)
+    @optional_auth
+    def get(self):
+        '''Get status (pending, running, succeeded, failed) of a service configurations update of current tenant'''
+        params = status_parser.parse_args()
+
+        publish_service = project_publisher_service_handler()
+        result = publish_service.config_update_status(params.get('job_id'))
+
+        if 'error' in result:
+            api.abort(404, result['error'])
+        return jsonify(result)
+
+
+@api.route('/invalidatepublishercache')
+class InvalidatePublisherCache(Resource):
+    @api.doc('invalidatepublishercache')
+    @optional_auth
+    def post(self):
+        '''Remove cached publisher role decisions of current tenant in all worker processes'''
+        access_control = access_control_handler()
+        access_control.invalidate_cache()
+
+        identity = get_identity()
+        app.logger.info('User %s invalidated publisher role cache of tenant %s' % (
+            get_username(identity), access_control.tenant))
+
+        return jsonify({'success': "Publisher role cache invalidated"})
+
+
+""" Prometheus metrics endpoint """
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    return Response(REGISTRY.expose(), mimetype='text/plain; version=0.0.4')
+
+
 """ readyness probe endpoint """
 
 
@@ -0,0 +1,271 @@
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+# stat of a stored object, sha256 is set if stored with the object
+ObjectStat = namedtuple('ObjectStat', ['st_size', 'st_mtime', 'st_mtime_ns', 'sha256'])
+
+
+class Storage:
+    """Storage class
+    Base class of project storages. Projects are written and read through
+    local files in base_dir: writers replace the local file of a project,
+    then commit it to the storage.
+    Stat results are cached for stat_cache_ttl seconds.
+    """
+
+    def __init__(self, base_dir, stat_cache_ttl=0, stat_cache_size=100000):
+        """Constructor
+        :param str base_dir: Dir of local project files
+        :param float stat_cache_ttl: Lifetime in seconds of cached stat results, 0 to disable
+        :param int stat_cache_size: Max number of cached stat results
+        """
+        self.base_dir = base_dir
+        self.stat_cache_ttl = stat_cache_ttl
+        self.stat_cache_size = stat_cache_size
+
+        # stat_cache[relpath] = (expires, stat)
+        self.stat_cache = OrderedDict()
+        self.stat_cache_lock = threading.Lock()
+
+    def path(self, relpath):
+        """Return path of local file of a project
+        :param str relpath: Project path relative to scan dir
+        """
+        return os.path.join(self.base_dir, relpath)
+
+    def stat(self, relpath):
+        """Return stat of a project, raise OSError if it does not exist
+        :param str relpath: Project path relative to scan dir
+        """
+        if self.stat_cache_ttl > 0:
+            with self.stat_cache_lock:
+                cached = self.stat_cache.get(relpath)
+                if cached and cached[0] > time.monotonic():
+                    return cached[1]
+        stat = self.stat_uncached(relpath)
+        self.cache_stat(relpath, stat)
+        return stat
+
+    def exists(self, relpath):
+        try:
+            self.stat(relpath)
+            return True
+        except OSError:
+            return False
+
+    def cache_stat(self, relpath, stat):
+        if self.stat_cache_ttl <= 0:
+            return
+        with self.stat_cache_lock:
+            self.stat_cache[relpath] = (time.monotonic() + self.stat_cache_ttl, stat)
+            self.stat_cache.move_to_end(relpath)
+            while len(self.stat_cache) > self.stat_cache_size:
+                self.stat_cache.popitem(last=False)
+
+    def invalidate(self, relpath):
+        with self.stat_cache_lock:
+            self.stat_cache.pop(relpath, None)
+
+    def stat_uncached(self, relpath):
+        raise NotImplementedError
+
+    def list(self, prefix=''):
+        """Yield (relpath, stat) of stored files whose path starts with prefix
+        :param str prefix: Path prefix
+        """
+        raise NotImplementedError
+
+    def fetch(self, relpath):
+        """Return path of up to date local file of a project,
+        raise OSError if it does not exist
+        :param str relpath: Project path relative to scan dir
+        """
+        raise NotImplementedError
+
+    def commit(self, relpath, sha256=None):
+        """Store local file of a project after it has been replaced
+        :param str relpath: Project path relative to scan dir
+        :param str sha256: SHA-256 of project file
+        """
+        raise NotImplementedError
+
+    def remove(self, relpath):
+        """Remove a project, and its local file if it still exists
+        :param str relpath: Project path relative to scan dir
+        """
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """LocalStorage class
+    Projects stored as files in QWC2 scan dir, on a POSIX file system.
+    """
+
+    def stat_uncached(self, relpath):
+        return os.stat(self.path(relpath))
+
+    def list(self, prefix=''):
+        # walk from deepest dir of prefix only
+        top = os.path.dirname(prefix)
+        for dirpath, dirs, files in os.walk(os.path.join(self.base_dir, top), followlinks=True):
+            # skip internal dirs, e.g. version store
+            dirs[:] = [d for d in dirs if not d.startswith('.qwc_publisher')]
+            relscanpath = os.path.relpath(dirpath, self.base_dir)
+            if relscanpath == '.':
+                relscanpath = ''
+            for filename in files:
+                relpath = os.path.join(relscanpath, filename)
+                if not relpath.startswith(prefix):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                self.cache_stat(relpath, stat)
+                yield relpath, stat
+
+    def fetch(self, relpath):
+        os.stat(self.path(relpath))
+        return self.path(relpath)
+
+    def commit(self, relpath, sha256=None):
+        # file is already in place
+        self.invalidate(relpath)
+
+    def remove(self, relpath):
+        self.invalidate(relpath)
+        if os.path.exists(self.path(relpath)):
+            os.remove(self.path(relpath))
+
+
+class S3Storage(Storage):
+    """S3Storage class
+    Projects stored as objects in an S3-compatible object store, under a key
+    prefix. Local files in base_dir are a read-through cache of objects,
+    validated against object size and modification time.
+    Objects are uploaded and downloaded with multipart transfers, and their
+    SHA-256 is stored in object metadata.
+    """
+
+    def __init__(self, base_dir, bucket, logger, prefix='', endpoint_url=None, region=None,
+                 stat_cache_ttl=5, stat_cache_size=100000,
+                 multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                 page_size=1000):
+        """Constructor
+        :param str base_dir: Dir of cached project files
+        :param str bucket: Bucket name
+        :param Logger logger: Application logger
+        :param str prefix: Key prefix of projects
+        :param str endpoint_url: S3 endpoint URL, e.g. of MinIO
+        :param str region: Region name
+        :param float stat_cache_ttl: Lifetime in seconds of cached stat results, 0 to disable
+        :param int stat_cache_size: Max number of cached stat results
+        :param int multipart_threshold: Min size in bytes of multipart transfers
+        :param int multipart_chunksize: Part size in bytes of multipart transfers
+        :param int page_size: Number of objects per listing request
+        """
+        super().__init__(base_dir, stat_cache_ttl, stat_cache_size)
+        # S3 storage is optional, import boto3 only if used
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("boto3 is required for S3 storage")
+        self.ClientError = ClientError
+        self.bucket = bucket
+        self.logger = logger
+        self.prefix = prefix
+        self.page_size = page_size
+
+        self.client = boto3.session.Session().client(
+            's3', endpoint_url=endpoint_url or None, region_name=region or None)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize)
+
+    def key(self, relpath):
+        return self.prefix + relpath.replace(os.sep, '/')
+
+    def object_stat(self, last_modified, size, sha256=None):
+        mtime = int(last_modified.timestamp())
+        return ObjectStat(size, float(mtime), mtime * 10**9, sha256)
+
+    def stat_uncached(self, relpath):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self.key(relpath))
+        except self.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ['404', 'NoSuchKey', 'NotFound']:
+                raise FileNotFoundError("No object '%s'" % self.key(relpath))
+            raise OSError(str(e))
+        return self.object_stat(
+            response['LastModified'], response['ContentLength'],
+            response.get('Metadata', {}).get('sha256'))
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(
+            Bucket=self.bucket, Prefix=self.key(prefix),
+            PaginationConfig={'PageSize': self.page_size})
+        for page in pages:
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('/'):
+                    continue
+                relpath = obj['Key'][len(self.prefix):].replace('/', os.sep)
+                stat = self.object_stat(obj['LastModified'], obj['Size'])
+                self.cache_stat(relpath, stat)
+                yield relpath, stat
+
+    def fetch(self, relpath):
+        stat = self.stat(relpath)
+        path = self.path(relpath)
+        try:
+            local_stat = os.stat(path)
+            if local_stat.st_size == stat.st_size and local_stat.st_mtime_ns == stat.st_mtime_ns:
+                return path
+        except OSError:
+            pass
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=".%s." % os.path.basename(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            self.client.download_file(
+                self.bucket, self.key(relpath), tmp_path, Config=self.transfer_config)
+            os.utime(tmp_path, ns=(stat.st_mtime_ns, stat.st_mtime_ns))
+            os.replace(tmp_path, path)
+        except self.ClientError as e:
+            raise OSError(str(e))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    def commit(self, relpath, sha256=None):
+        path = self.path(relpath)
+        self.invalidate(relpath)
+        try:
+            extra_args = {'Metadata': {'sha256': sha256}} if sha256 else None
+            self.client.upload_file(
+                path, self.bucket, self.key(relpath), ExtraArgs=extra_args,
+                Config=self.transfer_config)
+            stat = self.stat(relpath)
+            # mark local file as up to date
+            os.utime(path, ns=(stat.st_mtime_ns, stat.st_mtime_ns))
+        except Exception as e:
+            # local file is not stored, fetch object again on next read
+            if os.path.exists(path):
+                os.remove(path)
+            raise OSError(str(e))
+
+    def remove(self, relpath):
+        self.invalidate(relpath)
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(relpath))
+        except self.ClientError as e:
+            raise OSError(str(e))
+        if os.path.exists(self.path(relpath)):
+            os.remove(self.path(relpath))
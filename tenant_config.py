@@ -0,0 +1,70 @@
+import os
+import threading
+
+from qwc_services_core.runtime_config import RuntimeConfig
+
+
+class TenantConfigCache:
+    """TenantConfigCache class
+    Tenant service configs, shared by all handlers of a service.
+    A config is only read again when its file modification time changes,
+    and handlers are only created again when their config has been read again.
+    """
+
+    def __init__(self, service, logger):
+        """Constructor
+        :param str service: Service name
+        :param Logger logger: Application logger
+        """
+        self.service = service
+        self.logger = logger
+
+        # configs[tenant] = (mtime, RuntimeConfig)
+        self.configs = {}
+        # handlers[(handler_name, tenant)] = (RuntimeConfig, handler)
+        self.handlers = {}
+        self.lock = threading.RLock()
+
+    def tenant_config(self, tenant):
+        """Return RuntimeConfig of a tenant
+        :param str tenant: Tenant ID
+        """
+        path = RuntimeConfig.config_file_path(self.service, tenant)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = None
+
+        entry = self.configs.get(tenant)
+        if entry and entry[0] == mtime:
+            return entry[1]
+
+        with self.lock:
+            entry = self.configs.get(tenant)
+            if entry and entry[0] == mtime:
+                return entry[1]
+            config = RuntimeConfig(self.service, self.logger).tenant_config(tenant)
+            self.configs[tenant] = (mtime, config)
+            return config
+
+    def handler(self, handler_name, tenant, factory):
+        """Return handler for tenant, created with factory(tenant, config)
+        :param str handler_name: Handler name
+        :param str tenant: Tenant ID
+        :param func factory: Handler constructor
+        """
+        config = self.tenant_config(tenant)
+        key = (handler_name, tenant)
+        entry = self.handlers.get(key)
+        if entry and entry[0] is config:
+            return entry[1]
+
+        with self.lock:
+            entry = self.handlers.get(key)
+            if entry and entry[0] is config:
+                return entry[1]
+            if entry and hasattr(entry[1], 'close'):
+                entry[1].close()
+            handler = factory(tenant, config)
+            self.handlers[key] = (config, handler)
+            return handler
@@ -0,0 +1,129 @@
+import hashlib
+import io
+import os
+import random
+import struct
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'examples'))
+
+from delta import COPY, DATA, DeltaError, DeltaReader, block_hashes
+from delta_client import encode_delta
+
+BLOCK_SIZE = 64
+
+
+def random_bytes(rand, size):
+    return bytes(rand.randrange(256) for i in range(size))
+
+
+def write_base(tmp_path, base):
+    path = str(tmp_path / 'base.qgs')
+    with open(path, 'wb') as fh:
+        fh.write(base)
+    return path
+
+
+def rebuild(base_path, delta, read_size=-1):
+    reader = DeltaReader(base_path, BLOCK_SIZE, io.BytesIO(delta))
+    try:
+        chunks = []
+        for chunk in iter(lambda: reader.read(read_size), b''):
+            chunks.append(chunk)
+        return b''.join(chunks)
+    finally:
+        reader.close()
+
+
+def round_trip(tmp_path, base, data, read_size=-1):
+    base_path = write_base(tmp_path, base)
+    blocks = block_hashes(base_path, BLOCK_SIZE)
+    delta = encode_delta(blocks, BLOCK_SIZE, len(base), data)
+    rebuilt = rebuild(base_path, delta, read_size)
+    assert hashlib.sha256(rebuilt).hexdigest() == hashlib.sha256(data).hexdigest()
+    return delta
+
+
+def copied_blocks(delta):
+    """Return number of blocks copied by delta instructions"""
+    count = 0
+    stream = io.BytesIO(delta)
+    for op in iter(lambda: stream.read(1), b''):
+        if op == COPY:
+            count += struct.unpack('>II', stream.read(8))[1]
+        else:
+            length, = struct.unpack('>I', stream.read(4))
+            stream.seek(length, os.SEEK_CUR)
+    return count
+
+
+def test_unchanged(tmp_path):
+    base = random_bytes(random.Random(1), 10 * BLOCK_SIZE)
+    delta = round_trip(tmp_path, base, base)
+    assert delta == COPY + struct.pack('>II', 0, 10)
+
+
+def test_shifted_blocks(tmp_path):
+    rand = random.Random(2)
+    base = random_bytes(rand, 20 * BLOCK_SIZE)
+    # insert and remove bytes, so that later blocks are at unaligned offsets
+    data = b'inserted' + base[:5 * BLOCK_SIZE] + base[5 * BLOCK_SIZE + 3:]
+    delta = round_trip(tmp_path, base, data)
+    assert copied_blocks(delta) >= 18
+    assert len(delta) < len(data) // 4
+
+
+def test_short_last_block(tmp_path):
+    rand = random.Random(3)
+    base = random_bytes(rand, 8 * BLOCK_SIZE + 17)
+    data = b'changed' + base[7:]
+    delta = round_trip(tmp_path, base, data)
+    assert delta.endswith(COPY + struct.pack('>II', 1, 8))
+
+
+def test_short_last_block_not_at_end(tmp_path):
+    rand = random.Random(4)
+    base = random_bytes(rand, 4 * BLOCK_SIZE + 17)
+    round_trip(tmp_path, base, base + b'appended')
+    round_trip(tmp_path, base, base[-17:] + base[:-17])
+
+
+def test_empty(tmp_path):
+    round_trip(tmp_path, b'', b'new project')
+    round_trip(tmp_path, b'old project', b'')
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_random_edits(tmp_path, seed):
+    rand = random.Random(seed)
+    base = random_bytes(rand, rand.randrange(1, 30 * BLOCK_SIZE))
+    data = bytearray(base)
+    for i in range(rand.randrange(1, 6)):
+        offset = rand.randrange(len(data) + 1)
+        if rand.random() < 0.5:
+            data[offset:offset] = random_bytes(rand, rand.randrange(1, 100))
+        else:
+            del data[offset:offset + rand.randrange(1, 100)]
+    round_trip(tmp_path, base, bytes(data), read_size=rand.choice([-1, 1, 7, 1000]))
+
+
+@pytest.mark.parametrize('delta', [
+    COPY + struct.pack('>I', 0),
+    DATA + struct.pack('>H', 10),
+    DATA + struct.pack('>I', 10) + b'short',
+    COPY + struct.pack('>II', 0, 5),
+    COPY + struct.pack('>II', 4, 1),
+    COPY + struct.pack('>II', 0, 0),
+    b'X'
+])
+def test_invalid_delta(tmp_path, delta):
+    base_path = write_base(tmp_path, random_bytes(random.Random(5), 3 * BLOCK_SIZE + 1))
+    reader = DeltaReader(base_path, BLOCK_SIZE, io.BytesIO(delta))
+    with pytest.raises(DeltaError):
+        reader.read()
+    assert reader.error
+    reader.close()
@@ -0,0 +1,307 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import tempfile
+import time
+from contextlib import contextmanager
+
+from file_locks import FileLocks
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def valid_sha256(sha256):
+    """Return True if value is a lowercase hex SHA-256 digest
+    :param str sha256: Value
+    """
+    return isinstance(sha256, str) and SHA256_PATTERN.match(sha256) is not None
+
+
+class VersionStore:
+    """VersionStore class
+    Content-addressed store of previous versions of project files.
+
+    Objects are stored once per SHA-256. Uncompressed objects are hard links
+    of the replaced or deleted project files, which are renamed over or
+    removed right after, so storing a version does not copy it. Rolling back
+    copies the object, so that the project file never shares its inode.
+    The version history of each project is kept in its own JSON file,
+    updated under a lock of this project only. Each project referencing an
+    object has a reference file, and objects are removed with their last
+    reference.
+    """
+
+    def __init__(self, store_dir, logger, compress=False, max_versions=10, max_bytes=0):
+        """Constructor
+        :param str store_dir: Store dir
+        :param Logger logger: Application logger
+        :param bool compress: Store gzip compressed objects (no hard links)
+        :param int max_versions: Max number of versions kept per project
+        :param int max_bytes: Max total size of stored objects, 0 for no limit
+        """
+        self.store_dir = store_dir
+        self.logger = logger
+        self.compress = compress
+        self.max_versions = max_versions
+        self.max_bytes = max_bytes
+
+        self.locks = FileLocks(os.path.join(store_dir, 'locks'), 256)
+
+    def object_path(self, sha256):
+        if not valid_sha256(sha256):
+            raise ValueError("Invalid SHA-256 %r" % sha256)
+        suffix = '.gz' if self.compress else ''
+        return os.path.join(self.store_dir, 'objects', sha256[:2], sha256 + suffix)
+
+    def find_object(self, sha256):
+        """Return path of stored object, compressed or not, or None"""
+        if not valid_sha256(sha256):
+            return None
+        for path in [
+            os.path.join(self.store_dir, 'objects', sha256[:2], sha256),
+            os.path.join(self.store_dir, 'objects', sha256[:2], sha256 + '.gz')
+        ]:
+            if os.path.exists(path):
+                return path
+        return None
+
+    def path_key(self, relpath):
+        return hashlib.sha1(relpath.encode('utf-8')).hexdigest()
+
+    def history_path(self, relpath):
+        key = self.path_key(relpath)
+        return os.path.join(self.store_dir, 'history', key[:2], key + '.json')
+
+    def refs_dir(self, sha256):
+        return os.path.join(self.store_dir, 'refs', sha256[:2], sha256)
+
+    def read_history(self, relpath):
+        try:
+            with open(self.history_path(relpath), encoding='utf-8') as fh:
+                return json.load(fh)['versions']
+        except (OSError, ValueError, KeyError):
+            return []
+
+    @contextmanager
+    def history(self, relpath):
+        """Load versions of a project under lock, save them on exit and
+        update object references"""
+        with self.locks.lock('history', relpath):
+            versions = self.read_history(relpath)
+            previous = set(v['sha256'] for v in versions if v['sha256'])
+            yield versions
+            current = set(v['sha256'] for v in versions if v['sha256'])
+
+            path = self.history_path(relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+                json.dump({'path': relpath, 'versions': versions}, fh)
+            os.replace(tmp_path, path)
+
+            for sha256 in current - previous:
+                self.add_ref(sha256, relpath)
+            for sha256 in previous - current:
+                self.remove_ref(sha256, relpath)
+
+    def add_ref(self, sha256, relpath):
+        with self.locks.lock('object', sha256):
+            refs_dir = self.refs_dir(sha256)
+            os.makedirs(refs_dir, exist_ok=True)
+            with open(os.path.join(refs_dir, self.path_key(relpath)), 'a'):
+                pass
+
+    def remove_ref(self, sha256, relpath):
+        """Remove reference of a project to an object, and the object if it
+        was the last reference"""
+        with self.locks.lock('object', sha256):
+            refs_dir = self.refs_dir(sha256)
+            try:
+                os.remove(os.path.join(refs_dir, self.path_key(relpath)))
+                os.rmdir(refs_dir)
+            except OSError:
+                # other references left
+                return
+            object_path = self.find_object(sha256)
+            if object_path:
+                os.remove(object_path)
+
+    def store(self, relpath, path, sha256, move=False):
+        """Store current content of a project file before it is replaced
+        :param str relpath: Project path relative to scan dir
+        :param str path: Project file path
+        :param str sha256: SHA-256 of project file
+        :param bool move: Move file into store instead of linking it
+        """
+        object_path = self.object_path(sha256)
+        with self.history(relpath) as versions:
+            # reference object before storing it, so that it is not
+            # removed by another project meanwhile
+            self.add_ref(sha256, relpath)
+            with self.locks.lock('object', sha256):
+                if not self.find_object(sha256):
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    if self.compress:
+                        self.copy(path, object_path, compress=True)
+                        if move:
+                            os.remove(path)
+                    else:
+                        try:
+                            if move:
+                                os.rename(path, object_path)
+                            else:
+                                os.link(path, object_path)
+                        except OSError:
+                            # e.g. store on another file system
+                            self.copy(path, object_path)
+                            if move:
+                                os.remove(path)
+                elif move:
+                    os.remove(path)
+                size = os.path.getsize(self.find_object(sha256))
+
+            if not versions or versions[-1]['sha256'] != sha256:
+                # project published before versioning or changed out-of-band
+                versions.append(self.version(sha256, size, 'found'))
+            self.trim(versions)
+        self.evict_bytes()
+
+    def record(self, relpath, sha256, size, event):
+        """Add version to project history
+        :param str relpath: Project path relative to scan dir
+        :param str sha256: SHA-256 of project file, None if deleted
+        :param int size: Size of project file
+        :param str event: published, deleted or rollback
+        """
+        with self.history(relpath) as versions:
+            versions.append(self.version(sha256, size, event))
+            self.trim(versions)
+
+    def version(self, sha256, size, event):
+        return {'sha256': sha256, 'size': size, 'time': time.time(), 'event': event}
+
+    def versions(self, relpath):
+        """Return versions of a project, oldest first
+        :param str relpath: Project path relative to scan dir
+        """
+        versions = self.read_history(relpath)
+        for version in versions:
+            version['stored'] = bool(version['sha256']) and \
+                self.find_object(version['sha256']) is not None
+        return versions
+
+    def restore(self, relpath, sha256, path):
+        """Atomically replace project file with a copy of a stored version
+        :param str relpath: Project path relative to scan dir
+        :param str sha256: SHA-256 of version
+        :param str path: Project file path
+        """
+        object_path = self.find_object(sha256)
+        if object_path is None:
+            return False
+
+        # copy instead of linking, so that later in-place edits of the
+        # project file do not change the stored object
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=".%s." % os.path.basename(path), suffix='.tmp')
+        try:
+            digest = hashlib.sha256()
+            opener = gzip.open if object_path.endswith('.gz') else open
+            with opener(object_path, 'rb') as fsrc, os.fdopen(fd, 'wb') as fdst:
+                for chunk in iter(lambda: fsrc.read(COPY_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    fdst.write(chunk)
+            if digest.hexdigest() != sha256:
+                self.logger.warning(
+                    "Stored version %s of %s does not match its hash" % (sha256, relpath))
+                return False
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(object_path).st_mode))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.record(relpath, sha256, os.path.getsize(path), 'rollback')
+        return True
+
+    def trim(self, versions):
+        """Keep max_versions versions"""
+        if self.max_versions > 0 and len(versions) > self.max_versions:
+            del versions[:len(versions) - self.max_versions]
+
+    def evict_bytes(self):
+        """Remove oldest versions of all projects until store size is below
+        max_bytes. Skipped while another process evicts."""
+        if self.max_bytes <= 0:
+            return
+        with self.locks.lock('evict', 'store', blocking=False) as locked:
+            if not locked:
+                return
+            total = self.total_bytes()
+            if total <= self.max_bytes:
+                return
+
+            history = []
+            for relpath in self.history_relpaths():
+                versions = self.read_history(relpath)
+                # never evict the latest version of a project
+                for version in versions[:-1]:
+                    history.append((version['time'], relpath, version))
+            history.sort(key=lambda item: item[0])
+
+            for _, relpath, version in history:
+                if total <= self.max_bytes:
+                    break
+                object_path = self.find_object(version['sha256'])
+                size = os.path.getsize(object_path) if object_path else 0
+                with self.history(relpath) as versions:
+                    if version in versions[:-1]:
+                        versions.remove(version)
+                if object_path and not os.path.exists(object_path):
+                    total -= size
+
+    def total_bytes(self):
+        total = 0
+        objects_dir = os.path.join(self.store_dir, 'objects')
+        if not os.path.isdir(objects_dir):
+            return 0
+        for subdir in os.scandir(objects_dir):
+            if subdir.is_dir():
+                for entry in os.scandir(subdir.path):
+                    try:
+                        total += entry.stat().st_size
+                    except OSError:
+                        pass
+        return total
+
+    def history_relpaths(self):
+        history_dir = os.path.join(self.store_dir, 'history')
+        if not os.path.isdir(history_dir):
+            return
+        for subdir in os.scandir(history_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path, encoding='utf-8') as fh:
+                        yield json.load(fh)['path']
+                except (OSError, ValueError, KeyError):
+                    continue
+
+    def copy(self, src, dst, compress=False, decompress=False):
+        opener = gzip.open if decompress else open
+        with opener(src, 'rb') as fsrc:
+            if compress:
+                with gzip.open(dst, 'wb') as fdst:
+                    shutil.copyfileobj(fsrc, fdst)
+            else:
+                with open(dst, 'wb') as fdst:
+                    shutil.copyfileobj(fsrc, fdst)